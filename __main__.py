@@ -1,11 +1,19 @@
 import bottle
+import io
 import os
 import re
 import hashlib
+import threading
 
 from unicodedata import normalize
+from urllib.parse import urlencode
 
 from src.model import Game
+from src.pgn import read_games, replay, write_tags, write_movetext, PgnGame
+from src.pgn_index import build_index_once, index_in_background, load_index, read_game, filter_games
+from src.binary_game import dump_game, load_game, is_binary_game, MAGIC
+from src.timeline import Timeline
+from src.move_cache import LegalMoveCache
 from src.definicije import *
 
 class User:
@@ -13,11 +21,13 @@ class User:
         self.username = username
         self.key = key
         self.salt = salt
+        self.imports = []
         self.setup_game()
 
     def setup_game(self):
         self.current_file = ''
         self.game = Game()
+        self.timeline = Timeline(self.game)
 
         self.moves = []
         self.current_move_number = 0
@@ -35,9 +45,89 @@ class User:
             idx -= 1
         return idx
 
+    @property
+    def position_key(self):
+        '''
+            Zobrist ključ trenutne pozicije kot šestnajstiški niz (npr. za naslove v API-ju).
+        '''
+        return f'{self.game.position_hash:016x}'
+
+    def goto(self, ply):
+        '''
+            Vmesnik postavimo na dano polpotezo (0 je začetna pozicija). Igro obnovimo
+            s pomočjo časovnice, zato skok ni odvisen od dolžine igre.
+        '''
+        ply = min(max(0, ply), len(self.moves))
+        self.game = self.timeline.restore(ply, self.moves, self.game)
+        self.current_move_number = (ply + 1) // 2
+        self.last_played = Color.White if ply % 2 else Color.Black
+
+class PgnImport:
+    '''
+        Uvoz PGN datoteke, ki teče v ločeni niti, da ne zadrži strežnika. Vsako partijo
+        preverimo in jo shranimo kot svojo datoteko med uporabnikove shranjene igre; če ime
+        že obstaja, izberemo prosto ime (glej create_free_file). Partij, ki se ne začnejo
+        v začetni poziciji, vmesnik ne podpira, zato jih preskočimo.
+    '''
+    def __init__(self, username, filepath, name):
+        self.username = username
+        self.filepath = filepath
+        self.name = name
+
+        self.games_read = 0
+        self.games_saved = 0
+        self.errors = 0
+        self.finished = False
+        self.failure = None
+
+    def start(self):
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def run(self):
+        saved_dir = os.path.join(USERS_DIR, self.username, SAVED_GAMES_DIR)
+        try:
+            build_index_once(self.filepath)   # zbirko lahko brskamo že med uvozom (glej /collection)
+            with open(self.filepath, encoding='utf-8', errors='replace') as f:
+                for pgn_game in read_games(f):
+                    self.games_read += 1
+                    try:
+                        if 'FEN' in pgn_game.tags:
+                            raise ValueError('Unsupported starting position')
+                        game = replay(pgn_game)
+                    except ValueError:
+                        self.errors += 1
+                        continue
+
+                    moves = [(*played, pgn_move.anno, pgn_move.comment)
+                             for played, pgn_move in zip(game.moves, pgn_game.moves)]
+                    with create_free_file(saved_dir, sanitize_filename(f'{self.name}-{self.games_read}')) as out:
+                        write_tags(out, pgn_game.tags)
+                        write_movetext(out, moves)
+                        out.write(' ' + pgn_game.result)
+                    self.games_saved += 1
+        except OSError as err:
+            self.failure = str(err)
+        finally:
+            self.finished = True
+
+    def status(self):
+        return {
+            'name': self.name,
+            'games_read': self.games_read,
+            'games_saved': self.games_saved,
+            'errors': self.errors,
+            'finished': self.finished,
+            'failure': self.failure
+        }
+
 USERS_DIR = 'Users'
 SAVED_GAMES_DIR = 'saved'
+UPLOADS_DIR = 'uploads'
 TEMP_PGN_NAME = 'current.pgn'
+GAMES_PER_PAGE = 50
+LEGAL_MOVE_CACHE_SIZE = 4096
+
+LEGAL_MOVES = LegalMoveCache(LEGAL_MOVE_CACHE_SIZE)   # skupen vsem uporabnikom
 
 USERS = {}
 SECRET = 'DO YOU WISH FOR A NEW WORLD?'
@@ -62,6 +152,29 @@ def sanitize_filename(fname):   # spremenjena verzija metode v bottle.FileUpload
     fname = re.sub(r'[-\s]+', '-', fname).strip('.-')
     return fname[:255] or None
 
+def free_filename(directory, filename):
+    '''
+        Vrnemo ime, ki v mapi še ne obstaja: če je ime zasedeno, mu dodamo -2, -3, ...
+    '''
+    stem, ext = os.path.splitext(filename)
+    candidate = filename
+    n = 1
+    while os.path.exists(os.path.join(directory, candidate)):
+        n += 1
+        candidate = f'{stem}-{n}{ext}'
+    return candidate
+
+def create_free_file(directory, filename, mode='x'):
+    '''
+        Ustvarimo in odpremo datoteko s prostim imenom (glej free_filename). Če ime med
+        iskanjem in ustvarjanjem zasede kdo drug (npr. hkraten uvoz), vzamemo naslednje.
+    '''
+    while True:
+        try:
+            return open(os.path.join(directory, free_filename(directory, filename)), mode)
+        except FileExistsError:
+            continue
+
 def get_current_user():
     username = bottle.request.get_cookie('username', secret=SECRET)
     if username is None:
@@ -139,12 +252,81 @@ def logout():
 def user():
     user = get_current_user()
     names = os.listdir(os.path.join(USERS_DIR, user.username, SAVED_GAMES_DIR))
-    return bottle.template('user.html', filenames=names, user=user)
+
+    collections = {}
+    uploads_dir = os.path.join(USERS_DIR, user.username, UPLOADS_DIR)
+    if os.path.isdir(uploads_dir):
+        for name in os.listdir(uploads_dir):
+            if name.lower().endswith('.pgn'):
+                entries = load_index(os.path.join(uploads_dir, name))
+                collections[name] = None if entries is None else len(entries)
+    return bottle.template('user.html', filenames=names, collections=collections, user=user)
+
+@bottle.get('/collection')
+def collection():
+    '''
+        Partije iz naložene PGN datoteke prikažemo po straneh, po želji le tiste, ki ustrezajo
+        iskanju po igralcu, turnirju, datumu ali rezultatu. Značke preberemo iz indeksa,
+        zato je prikaz strani enako hiter ne glede na velikost datoteke. Dokler indeksa
+        ni, ga gradimo v ozadju in prikažemo obvestilo.
+    '''
+    user = get_current_user()
+    filename = os.path.basename(bottle.request.query.name)
+    filepath = os.path.join(USERS_DIR, user.username, UPLOADS_DIR, filename)
+    if not filename or not os.path.isfile(filepath):
+        bottle.redirect('/user')
+
+    conditions = {key: bottle.request.query.getunicode(key, default='').strip()
+                  for key in ('player', 'event', 'date', 'result')}
+    entries = index_in_background(filepath)
+    if entries is None:
+        return bottle.template('collection.html', filename=filename, games=None,
+                               conditions=conditions, query='', page=1, pages=1, user=user)
+
+    games = filter_games(entries, **conditions)
+    pages = max(1, -(-len(games) // GAMES_PER_PAGE))
+    try:
+        page = min(max(1, int(bottle.request.query.page or 1)), pages)
+    except ValueError:
+        page = 1
+    first = (page - 1) * GAMES_PER_PAGE
+    query = urlencode({'name': filename, **conditions})
+    return bottle.template('collection.html', filename=filename, games=games[first:first + GAMES_PER_PAGE],
+                           conditions=conditions, query=query, page=page, pages=pages, user=user)
 
 @bottle.get('/analysis')
 def analysis():
     return bottle.template('analysis.html', user=get_current_user())
 
+@bottle.get('/api/legal_moves/<key>')
+def api_legal_moves(key):
+    '''
+        Legalne poteze trenutne pozicije v obliki JSON (notacija ter začetno in ciljno polje).
+        Odgovor je odvisen le od pozicije, katere ključ je v naslovu, zato ga brskalnik lahko
+        shrani in ga ob ponovnem obisku iste pozicije ne zahteva znova.
+    '''
+    user = get_current_user()
+    if key != user.position_key:
+        bottle.abort(404, 'Position is not the current position')
+
+    etag = f'"{key}"'
+    bottle.response.set_header('Cache-Control', 'private, max-age=86400')
+    bottle.response.set_header('ETag', etag)
+    if bottle.request.get_header('If-None-Match') == etag:
+        bottle.response.status = 304
+        return ''
+
+    moves = [
+        {'san': cached.san, 'from': cached.start, 'to': cached.target}
+        for cached in LEGAL_MOVES.legal_moves(user.game)
+    ]
+    return {'hash': key, 'moves': moves}
+
+@bottle.get('/api/legal_move_cache')
+def api_legal_move_cache():
+    get_current_user()
+    return LEGAL_MOVES.stats()
+
 @bottle.post('/make_move')
 def make_move():
     '''
@@ -164,6 +346,7 @@ def make_move():
         pass
     else:
         user.moves.append((*user.game.moves[-1], annotation, text))
+        user.timeline.record(user.game)
 
         user.current_move_number = user.game.full_move_number
         if user.game.current_color == Color.White:
@@ -189,12 +372,7 @@ def update_move():
     updated_move = (move[0], move[1], anno, text)
     user.moves[idx] = updated_move
 
-    user.game.make_move(move[0])
-    user.current_move_number = user.game.full_move_number
-    if user.game.current_color == Color.White:
-        user.current_move_number -= 1
-    user.last_played = user.game.last_move.color
-
+    user.goto(idx + 1)
     bottle.redirect('/analysis')
 
 @bottle.post('/to_first')
@@ -203,9 +381,7 @@ def to_first():
         Spremenimo stanje vmesnika, da prikažemo začetno pozicijo.
     '''
     user = get_current_user()
-    user.last_played = Color.Black
-    user.current_move_number = 0
-    user.game = Game()
+    user.goto(0)
 
     bottle.redirect('/analysis')
 
@@ -215,10 +391,7 @@ def previous_move():
         Spremenimo stanje vmesnika, da prikažemo prejšno pozicijo.
     '''
     user = get_current_user()
-    user.game.undo_last_move()
-    if user.last_played == Color.White:
-        user.current_move_number -= 1
-    user.last_played = other_color(user.last_played)
+    user.goto(user.next_move_idx() - 1)
     bottle.redirect('/analysis')
 
 @bottle.post('/next_move')
@@ -227,11 +400,7 @@ def next_move():
         Spremenimo stanje vmesnika, da prikažemo naslednjo pozicijo.
     '''
     user = get_current_user()
-    next_move = user.moves[user.next_move_idx()]
-    user.game.make_move(next_move[0])
-    if user.last_played == Color.Black:
-        user.current_move_number += 1
-    user.last_played = other_color(user.last_played)
+    user.goto(user.next_move_idx() + 1)
     bottle.redirect('/analysis')
 
 @bottle.post('/to_last')
@@ -240,13 +409,17 @@ def to_last():
         Spremenimo stanje vmesnika, da prikažemo zadnjo pozicijo.
     '''
     user = get_current_user()
-    for move, _, _, _ in user.moves[user.next_move_idx():]:
-        user.game.make_move(move)
-    user.last_played = user.game.last_move.color
-    if user.last_played == Color.Black:
-        user.current_move_number = user.game.full_move_number - 1
-    else:
-        user.current_move_number = user.game.full_move_number
+    user.goto(len(user.moves))
+    bottle.redirect('/analysis')
+
+@bottle.post('/goto/<ply:int>')
+def goto(ply):
+    '''
+        Spremenimo stanje vmesnika, da prikažemo pozicijo po izbrani polpotezi. Igro obnovimo
+        iz najbližjega posnetka na časovnici in odigramo le manjkajoče poteze.
+    '''
+    user = get_current_user()
+    user.goto(ply)
     bottle.redirect('/analysis')
 
 @bottle.post('/remove_from_now')
@@ -256,6 +429,7 @@ def remove_from_now():
     '''
     user = get_current_user()
     user.moves = user.moves[:user.next_move_idx()]
+    user.timeline.truncate(len(user.moves))
     user.game_end = user.game.game_state
     bottle.redirect('/analysis')
 
@@ -270,30 +444,33 @@ def save_moves():
     '''
         Preberemo novo ime datoteke in ga spremenimo, da je primerno za shranjevanje na disk.
         Nato zapišemo poteze po PGN standardu (pri čemer nimamo zapisanih nobenih značk,
-        ki jih standard dopušča).
+        ki jih standard dopušča) ali pa v kompaktnem binarnem zapisu (glej src/binary_game.py).
+        Igro, ki ne ustreza omejitvam binarnega zapisa, shranimo po PGN standardu.
     '''
     user = get_current_user()
     result = bottle.request.forms.result
     filename = sanitize_filename(bottle.request.forms.filename)
     overwrite = bool(bottle.request.forms.overwrite)
+    compact = bool(bottle.request.forms.compact)
 
     filepath = os.path.join(USERS_DIR, user.username, SAVED_GAMES_DIR, filename)
     if not overwrite and os.path.exists(filepath):
         bottle.redirect('/analysis')
 
-    with open(filepath, 'w') as f:
-        for idx, (move, notation_info, anno, text) in enumerate(user.moves):
-            alg_notation = to_algebraic_notation(move, notation_info)
-            if idx == 0:
-                f.write('1.')
-            elif move.color == Color.White:
-                f.write(f' {idx // 2 + 1}.')
-            f.write(f' {alg_notation}')
-            if anno != '0':
-                f.write(f'${anno}')
-            if text:
-                f.write(f' {{{text}}}')
-        f.write(' ' + result)
+    if compact:
+        data = io.BytesIO()
+        try:
+            dump_game(data, user.moves, result)
+        except ValueError:   # igra ne ustreza omejitvam binarnega zapisa, zato jo shranimo v PGN
+            compact = False
+
+    if compact:
+        with open(filepath, 'wb') as f:
+            f.write(data.getvalue())
+    else:
+        with open(filepath, 'w') as f:
+            write_movetext(f, user.moves)
+            f.write(' ' + result)
 
     user.current_file = filename
     bottle.redirect('/analysis')
@@ -331,22 +508,41 @@ def export_pgn():
         f.write(f'[Black "{black_surname}, {black_name}"]\n')
         f.write(f'[Result "{result}"]\n\n')
 
-        for idx, (move, notation_info, anno, text) in enumerate(user.moves):
-            alg_notation = to_algebraic_notation(move, notation_info)
-            if idx == 0:
-                f.write('1.')
-            elif move.color == Color.White:
-                f.write(f' {idx // 2 + 1}.')
-            f.write(f' {alg_notation}')
-            if anno != '0':
-                f.write(f'${anno}')
-            if text:
-                f.write(f' {{{text}}}')
+        write_movetext(f, user.moves)
         if result != '*':
             f.write(f' {result}')
 
     return bottle.static_file(TEMP_PGN_NAME , root=root_path, download=True)
 
+@bottle.post('/import_pgn')
+def import_pgn():
+    '''
+        Naloženo PGN datoteko shranimo na disk in partije iz nje uvozimo v ozadju.
+        Napredek uvoza je viden na strani uporabnika (glej /import_status).
+    '''
+    user = get_current_user()
+    upload = bottle.request.files.get('pgn_file')
+    if upload is None or (filename := sanitize_filename(upload.raw_filename)) is None:
+        bottle.redirect('/user')
+
+    uploads_dir = os.path.join(USERS_DIR, user.username, UPLOADS_DIR)
+    os.makedirs(uploads_dir, exist_ok=True)
+    # ne povozimo datoteke, ki jo morda še uvažamo
+    with create_free_file(uploads_dir, filename, 'xb') as f:
+        upload.save(f)
+    filepath = f.name
+    filename = os.path.basename(filepath)
+
+    job = PgnImport(user.username, filepath, os.path.splitext(filename)[0])
+    user.imports.append(job)
+    job.start()
+    bottle.redirect('/user')
+
+@bottle.get('/import_status')
+def import_status():
+    user = get_current_user()
+    return {'imports': [job.status() for job in user.imports]}
+
 @bottle.post('/rename')
 def rename():
     user = get_current_user()
@@ -359,6 +555,20 @@ def rename():
     os.rename(old_filepath, new_filepath)
     bottle.redirect('/user')
 
+def load_pgn_game(user, pgn_game, filename):
+    '''
+        Poteze partije odigramo in jih prikažemo v vmesniku od začetne pozicije naprej.
+    '''
+    user.setup_game()
+    for pgn_move in pgn_game.moves:
+        user.game.make_move_from_notation(pgn_move.notation)
+        user.moves.append((*user.game.moves[-1], pgn_move.anno, pgn_move.comment))
+        user.timeline.record(user.game)
+
+    user.game_end = user.game.game_state
+    user.current_file = filename
+    to_first()
+
 @bottle.post('/launch')
 def launch():
     '''
@@ -367,43 +577,52 @@ def launch():
     user = get_current_user()
     filename = bottle.request.forms.filename
 
-    user.setup_game()
     filepath = os.path.join(USERS_DIR, user.username, SAVED_GAMES_DIR, filename)
-    with open(filepath, 'r') as f:
-        in_comment = False
-        notation = ''
-        anno = '0'
-        text = ''
-
-        for line in f:
-            for token in line.split():
-                if in_comment:
-                    if token.endswith('}'):
-                        in_comment = False
-                        text += f' {token[:-1]}'
-                    else:
-                        text += f' {token}'
-                    move, notation_info, annotation, _ = user.moves[-1]
-                    user.moves[-1] = (move, notation_info, annotation, text)
-                else:
-                    if token.startswith('{'):
-                        in_comment = True
-                        text = token[1:]
-                        continue
-                    if token in {'*', '1-0', '0-1', '1/2-1/2'} or token.endswith('.'):
-                        continue
-
-                    if '$' in token:
-                        notation, anno = token.split('$')
-                    else:
-                        notation = token
-                        anno = '0'
-                    user.game.make_move_from_notation(notation)
-                    user.moves.append((*user.game.moves[-1], anno, ''))
+    with open(filepath, 'rb') as f:
+        binary = is_binary_game(f.read(len(MAGIC)))
+        if binary:
+            f.seek(0)
+            user.setup_game()
+            loaded = load_game(f, on_move=user.timeline.record)
+
+    if binary:
+        user.moves = loaded.moves
+        user.game_end = loaded.game.game_state
+        user.current_file = filename
+        to_first()
+    else:
+        with open(filepath, 'r') as f:
+            pgn_game = next(read_games(f), PgnGame())
+        load_pgn_game(user, pgn_game, filename)
 
-    user.game_end = user.game.game_state
-    user.current_file = filename
-    to_first()
+@bottle.post('/launch_from_collection')
+def launch_from_collection():
+    '''
+        Iz naložene PGN datoteke preberemo le izbrano partijo (glej src/pgn_index.py)
+        in jo prikažemo v vmesniku.
+    '''
+    user = get_current_user()
+    filename = os.path.basename(bottle.request.forms.filename)
+    filepath = os.path.join(USERS_DIR, user.username, UPLOADS_DIR, filename)
+    try:
+        entries = load_index(filepath)
+        if entries is None:
+            bottle.redirect(f'/collection?name={filename}')
+        number = int(bottle.request.forms.game)
+        if number < 1:   # negativen indeks bi vzel partijo s konca seznama
+            raise IndexError('Game number out of range')
+        entry = entries[number - 1]
+    except (OSError, ValueError, IndexError):
+        bottle.redirect('/user')
+
+    pgn_game = read_game(filepath, entry)
+    if 'FEN' in pgn_game.tags:   # vmesnik vedno začne v začetni poziciji
+        bottle.redirect(f'/collection?name={filename}')
+    try:
+        load_pgn_game(user, pgn_game, f'{os.path.splitext(filename)[0]}-{number}')
+    except ValueError:
+        user.setup_game()
+        bottle.redirect(f'/collection?name={filename}')
 
 @bottle.post('/download')
 def download():
@@ -414,6 +633,18 @@ def download():
     filename = bottle.request.forms.filename
 
     root_path = os.path.join(USERS_DIR, user.username, SAVED_GAMES_DIR)
+    with open(os.path.join(root_path, filename), 'rb') as f:
+        if is_binary_game(f.read(len(MAGIC))):   # binarno shranjeno igro izvozimo kot PGN
+            f.seek(0)
+            loaded = load_game(f)
+            root_path = os.path.join(USERS_DIR, user.username)
+            with open(os.path.join(root_path, TEMP_PGN_NAME), 'w') as out:
+                if loaded.tags:
+                    write_tags(out, loaded.tags)
+                write_movetext(out, loaded.moves)
+                out.write(' ' + loaded.result)
+            return bottle.static_file(TEMP_PGN_NAME, root=root_path, download=f'{filename}.pgn')
+
     return bottle.static_file(filename , root=root_path, download=True)
 
 @bottle.post('/remove')
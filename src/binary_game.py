@@ -0,0 +1,250 @@
+'''
+    Kompaktni binarni zapis shranjenih iger. Vsaka polpoteza zasede dva bajta (začetno
+    in ciljno polje, promocijska figura ter bita za šah in dvoumnost), anotacije in
+    komentarji pa so v ločenih tabelah, saj ima le malo potez kaj od tega. Pri branju
+    ne razčlenjujemo notacije, temveč poteze opravimo neposredno iz zapisanih polj.
+
+    Zgradba datoteke (vsa števila so nepredznačena, little-endian):
+        MAGIC, verzija (1 B)
+        značke: število (2 B), nato ime (1 B dolžina + UTF-8) in vrednost (2 B dolžina + UTF-8)
+        rezultat: dolžina (1 B) + ASCII
+        poteze: število (2 B), nato po 2 B na polpotezo (glej pack_move)
+        anotacije: število (2 B), nato polpoteza (2 B) in NAG (1 B)
+        komentarji: število (2 B), nato polpoteza (2 B), dolžina (2 B) in UTF-8
+
+    Uporaba (iz projektne mape):
+        python -m src.binary_game partije.pgn      # primerjava velikosti in časa nalaganja
+'''
+import argparse
+import io
+import struct
+import time
+
+from collections import namedtuple
+
+from src.model import Game
+from src.pgn import read_games, replay, write_movetext
+from src.definicije import *
+
+MAGIC = b'CAGB'
+VERSION = 1
+
+PROMO_CODES = {Name.Queen: 0, Name.Rook: 1, Name.Bishop: 2, Name.Knight: 3}
+FROM_PROMO_CODE = {code: name for name, code in PROMO_CODES.items()}
+
+CHECK_BIT = 1 << 14
+AMBIGUOUS_BIT = 1 << 15
+
+# Prebrana igra: Game v končni poziciji, poteze v obliki (Move, NotationInfo, anotacija, tekst),
+# rezultat in značke.
+LoadedGame = namedtuple('LoadedGame', 'game moves result tags')
+
+def is_binary_game(data):
+    '''
+        Ali se bajti (npr. začetek datoteke) začnejo z oznako binarnega zapisa.
+    '''
+    return data[:len(MAGIC)] == MAGIC
+
+def pack_move(move, notation_info):
+    '''
+        Potezo zapišemo v 16 bitov: začetno polje (6), ciljno polje (6), promocijska
+        figura (2), šah (1) in dvoumnost (1). Ostalo o notaciji izračunamo pri branju.
+    '''
+    word = pos_to_index(move.start) | pos_to_index(move.target) << 6
+    if move.promo_piece is not None:
+        word |= PROMO_CODES[move.promo_piece] << 12
+    if notation_info.check:
+        word |= CHECK_BIT
+    if not notation_info.unique:
+        word |= AMBIGUOUS_BIT
+    return word
+
+def _check_limit(value, fmt):
+    if not 0 <= value < 1 << 8 * struct.calcsize(fmt):
+        raise ValueError('Game does not fit the binary format')
+
+def _write_string(out, text, length_format):
+    data = text.encode('utf-8')
+    _check_limit(len(data), length_format)
+    out.append(struct.pack(length_format, len(data)))
+    out.append(data)
+
+def dump_game(f, moves, result='*', tags=None):
+    '''
+        Poteze v obliki (Move, NotationInfo, anotacija, tekst) z rezultatom in značkami
+        zapišemo v binarno datoteko f. Če igra ne ustreza omejitvam zapisa (npr. več kot
+        65535 polpotez ali predolg komentar), sprožimo ValueError, preden karkoli zapišemo.
+    '''
+    tags = tags or {}
+    _check_limit(len(tags), '<H')
+    _check_limit(len(moves), '<H')
+    out = [MAGIC, struct.pack('<B', VERSION), struct.pack('<H', len(tags))]
+    for name, value in tags.items():
+        _write_string(out, name, '<B')
+        _write_string(out, value, '<H')
+    _write_string(out, result, '<B')
+
+    out.append(struct.pack(f'<H{len(moves)}H', len(moves), *(pack_move(move, info) for move, info, _, _ in moves)))
+
+    annotations = [(ply, int(anno)) for ply, (_, _, anno, _) in enumerate(moves) if anno != '0']
+    out.append(struct.pack('<H', len(annotations)))
+    for ply, nag in annotations:
+        _check_limit(nag, '<B')
+        out.append(struct.pack('<HB', ply, nag))
+
+    comments = [(ply, text) for ply, (_, _, _, text) in enumerate(moves) if text]
+    out.append(struct.pack('<H', len(comments)))
+    for ply, text in comments:
+        out.append(struct.pack('<H', ply))
+        _write_string(out, text, '<H')
+
+    f.write(b''.join(out))
+
+class _Reader:
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+
+    def unpack(self, fmt):
+        values = struct.unpack_from(fmt, self.data, self.pos)
+        self.pos += struct.calcsize(fmt)
+        return values
+
+    def string(self, length_format):
+        length, = self.unpack(length_format)
+        text = self.data[self.pos:self.pos + length]
+        if len(text) != length:
+            raise ValueError('Corrupt game file')
+        self.pos += length
+        return text.decode('utf-8')
+
+def _notation_info(game, figure, target, promo_piece, word, last):
+    '''
+        NotationInfo sestavimo iz zapisanih bitov in trenutne pozicije. Šah je zapisan,
+        mat je lahko le zadnja poteza, vzetje preberemo s šahovnice, stolpec in vrstico
+        za dvoumno notacijo pa poiščemo le, če je zapisana dvoumnost.
+    '''
+    notation_info = NotationInfo(promotion=promo_piece)
+    notation_info.check = bool(word & CHECK_BIT)
+    if notation_info.check and last:
+        notation_info.mate = game.is_mate_after(figure, target, promo_piece=promo_piece)
+
+    if word & AMBIGUOUS_BIT:
+        notation_info.unique = False
+        for fig in game.notation_candidates(figure.name, figure.color, target):
+            if fig is not figure and game.is_legal(fig, target, promo_piece=promo_piece):
+                if fig.rank == figure.rank:
+                    notation_info.rank = True
+                if fig.file == figure.file:
+                    notation_info.file = True
+
+    notation_info.captures = game.get_figure_by_pos(target) is not None or game.is_en_passant(figure, target)
+    return notation_info
+
+def load_game(f, *, on_move=None):
+    '''
+        Preberemo binarno datoteko f in poteze opravimo na novi šahovnici. Notacije ne
+        razčlenjujemo, NotationInfo pa sestavimo iz zapisanih bitov. Vsako potezo vseeno
+        preverimo z is_legal, zato pokvarjena datoteka (npr. nelegalna poteza ali promocijska
+        figura pri potezi, ki ni promocija) sproži ValueError. Če je podan on_move,
+        ga po vsaki potezi pokličemo z igro (npr. za zapis na časovnico).
+    '''
+    reader = _Reader(f.read())
+    try:
+        if not is_binary_game(reader.data):
+            raise ValueError('Not a binary game file')
+        reader.pos = len(MAGIC)
+        version, = reader.unpack('<B')
+        if version != VERSION:
+            raise ValueError(f'Unsupported binary game version {version}')
+
+        tag_count, = reader.unpack('<H')
+        tags = {}
+        for _ in range(tag_count):
+            name = reader.string('<B')
+            tags[name] = reader.string('<H')
+        result = reader.string('<B')
+
+        ply_count, = reader.unpack('<H')
+        words = reader.unpack(f'<{ply_count}H')
+
+        annotations = {}
+        annotation_count, = reader.unpack('<H')
+        for _ in range(annotation_count):
+            ply, nag = reader.unpack('<HB')
+            annotations[ply] = str(nag)
+
+        comments = {}
+        comment_count, = reader.unpack('<H')
+        for _ in range(comment_count):
+            ply, = reader.unpack('<H')
+            comments[ply] = reader.string('<H')
+    except (struct.error, UnicodeDecodeError):
+        raise ValueError('Corrupt game file')
+
+    game = Game()
+    moves = []
+    for ply, word in enumerate(words):
+        figure = game.mailbox[word & 63]
+        if figure is None or figure.color != game.current_color or game.game_state != GameState.Normal:
+            raise ValueError('Corrupt game file')
+        target = INDEX_TO_POS[word >> 6 & 63]
+        promo_piece = None
+        if figure.name == Name.Pawn and target[0] in {1, 8}:
+            promo_piece = FROM_PROMO_CODE[word >> 12 & 3]
+        elif word >> 12 & 3:
+            raise ValueError('Corrupt game file')
+        if not game.is_legal(figure, target, promo_piece=promo_piece):
+            raise ValueError('Corrupt game file')
+
+        last = ply == ply_count - 1
+        notation_info = _notation_info(game, figure, target, promo_piece, word, last)
+        move = game.get_move(figure, target, promo_piece=promo_piece)
+        game.make_move(move, notation_info, trusted=True, evaluate=last)
+        moves.append((move, notation_info, annotations.get(ply, '0'), comments.get(ply, '')))
+        if on_move is not None:
+            on_move(game)
+
+    return LoadedGame(game, moves, result, tags)
+
+def main():
+    parser = argparse.ArgumentParser(description='Primerjava PGN in binarnega zapisa iger.')
+    parser.add_argument('filename', help='pot do PGN datoteke')
+    args = parser.parse_args()
+
+    games = 0
+    pgn_size = binary_size = 0
+    pgn_time = binary_time = 0
+    with open(args.filename, encoding='utf-8', errors='replace') as f:
+        for pgn_game in read_games(f):
+            if 'FEN' in pgn_game.tags:
+                continue
+            try:
+                start = time.perf_counter()
+                game = replay(pgn_game)
+                pgn_time += time.perf_counter() - start
+            except ValueError:
+                continue
+            games += 1
+            moves = [(*played, pgn_move.anno, pgn_move.comment)
+                     for played, pgn_move in zip(game.moves, pgn_game.moves)]
+
+            text = io.StringIO()
+            write_movetext(text, moves)
+            pgn_size += len(text.getvalue().encode('utf-8'))
+
+            data = io.BytesIO()
+            dump_game(data, moves, pgn_game.result)
+            binary_size += len(data.getvalue())
+
+            data.seek(0)
+            start = time.perf_counter()
+            load_game(data)
+            binary_time += time.perf_counter() - start
+
+    print(f'Partije: {games}')
+    print(f'PGN:     {pgn_size:>10} B, nalaganje {pgn_time:.3f} s')
+    print(f'Binarno: {binary_size:>10} B, nalaganje {binary_time:.3f} s')
+
+if __name__ == '__main__':
+    main()
@@ -1,29 +1,49 @@
 from enum import Enum, auto
-from dataclasses import dataclass
+from collections import namedtuple
+import random
 import re
 
-@dataclass
+# Podatki o potezi in notaciji se hranijo za vsako polpotezo vsake igre, zato imajo
+# razredi __slots__ namesto slovarja atributov.
 class NotationInfo:
-    captures = False
-    check = False
-    mate = False
-    unique = True
-    file = False
-    rank = False
-    promotion = None
-
-@dataclass
+    __slots__ = ('captures', 'check', 'mate', 'unique', 'file', 'rank', 'promotion', 'san')
+
+    def __init__(self, captures=False, check=False, mate=False, unique=True,
+                 file=False, rank=False, promotion=None):
+        self.captures = captures
+        self.check = check
+        self.mate = mate
+        self.unique = unique
+        self.file = file
+        self.rank = rank
+        self.promotion = promotion
+        self.san = None   # figurinska notacija brez anotacije, ko jo prvič izrišemo
+
 class Move:
-    piece = None
-    color = None
-    start = None
-    target = None
-    promo_piece = None
-    en_passant = False
-    castling = False
-    captured = None
+    __slots__ = ('piece', 'color', 'start', 'target', 'promo_piece', 'en_passant', 'castling', 'captured')
+
+    def __init__(self, piece=None, color=None, start=None, target=None, promo_piece=None,
+                 en_passant=False, castling=False, captured=None):
+        self.piece = piece
+        self.color = color
+        self.start = start
+        self.target = target
+        self.promo_piece = promo_piece
+        self.en_passant = en_passant
+        self.castling = castling
+        self.captured = captured
+
+# Zapis za razveljavitev poteze: premaknjena figura in njeno začetno polje, vzeta figura,
+# figura, v katero je bil kmet promoviran, ter stanje pred potezo (pravice do roširanja kot
+# biti, polje za en passant, števec polpotez, možnost remija in Zobrist ključ pozicije).
+UndoRecord = namedtuple(
+    'UndoRecord',
+    'figure start captured promoted castling en_passant half_move claimable_draw position_hash'
+)
 
 class Name(Enum):
+    __hash__ = object.__hash__   # člani so unikatni, zato je dovolj hitrejše zgoščevanje po identiteti
+
     King = auto()
     Queen = auto()
     Rook = auto()
@@ -32,6 +52,8 @@ class Name(Enum):
     Pawn = auto()
 
 class Color(Enum):
+    __hash__ = object.__hash__   # člani so unikatni, zato je dovolj hitrejše zgoščevanje po identiteti
+
     White = auto()
     Black = auto()
 
@@ -42,11 +64,12 @@ class GameState(Enum):
     Black = auto()
 
 class Figure:
-    def __init__(self, name, color, position, possible_moves):
+    __slots__ = ('name', 'color', 'position')
+
+    def __init__(self, name, color, position):
         self.name = name
         self.color = color
         self.position = position
-        self.possible_moves = possible_moves
 
     @property
     def rank(self):
@@ -65,21 +88,146 @@ class Figure:
 DIRECTIONS = [(-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1)]
 
 KING_MOVES       = {(-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1)}
-ROOK_MOVES       = {(0, x) for x in range(-7, 8) if x != 0} | {(x, 0) for x in range(-7, 8) if x != 0}
-BISHOP_MOVES     = {(x, x) for x in range(-7, 8) if x != 0} | {(x, -x) for x in range(-7, 8) if x != 0}
-QUEEN_MOVES      = ROOK_MOVES | BISHOP_MOVES
 KNIGHT_MOVES     = {(-2, 1), (-1, 2), (1, 2), (2, 1), (2, -1), (1, -2), (-1, -2), (-2, -1)}
-WHITE_PAWN_MOVES = {(1, -1), (1, 0), (2, 0), (1, 1)}
-BLACK_PAWN_MOVES = {(-1, -1), (-1, 0), (-2, 0), (-1, 1)}
-
-PROMOTION_MOVES = {
-    Name.Queen:  QUEEN_MOVES,
-    Name.Rook:   ROOK_MOVES,
-    Name.Bishop: BISHOP_MOVES,
-    Name.Knight: KNIGHT_MOVES
-}
+
 PROMOTION_PIECES = {Name.Queen, Name.Rook, Name.Bishop, Name.Knight}
 
+# Bitne šahovnice: bit z indeksom 8 * (vrstica - 1) + (stolpec - 1) predstavlja polje,
+# torej je a1 najnižji, h8 pa najvišji bit 64-bitnega števila.
+INDEX_TO_POS = [(idx // 8 + 1, idx % 8 + 1) for idx in range(64)]
+SQUARE_BB = [1 << idx for idx in range(64)]
+ALL_SQUARES = (1 << 64) - 1
+
+ROOK_DIRECTIONS   = [(-1, 0), (0, -1), (0, 1), (1, 0)]
+BISHOP_DIRECTIONS = [(-1, -1), (-1, 1), (1, -1), (1, 1)]
+
+def _on_board(row, col):
+    return 1 <= row <= 8 and 1 <= col <= 8
+
+def _leaper_table(offsets):
+    table = []
+    for row, col in INDEX_TO_POS:
+        bitboard = 0
+        for dx, dy in offsets:
+            if _on_board(row + dx, col + dy):
+                bitboard |= 1 << (8 * (row + dx - 1) + col + dy - 1)
+        table.append(bitboard)
+    return table
+
+def _ray_table(direction):
+    dx, dy = direction
+    table = []
+    for row, col in INDEX_TO_POS:
+        bitboard = 0
+        r, c = row + dx, col + dy
+        while _on_board(r, c):
+            bitboard |= 1 << (8 * (r - 1) + c - 1)
+            r, c = r + dx, c + dy
+        table.append(bitboard)
+    return table
+
+KNIGHT_ATTACKS = _leaper_table(KNIGHT_MOVES)
+KING_ATTACKS   = _leaper_table(KING_MOVES)
+PAWN_ATTACKS   = {
+    Color.White: _leaper_table({(1, -1), (1, 1)}),
+    Color.Black: _leaper_table({(-1, -1), (-1, 1)})
+}
+
+# Za vsako smer shranimo tabelo žarkov in ali v tej smeri indeksi polj naraščajo
+# (takrat je najbližja ovira najnižji prižgan bit, sicer najvišji).
+RAYS = {direction: (_ray_table(direction), direction > (0, 0)) for direction in DIRECTIONS}
+
+def _pawn_targets(step, starting_row):
+    table = _leaper_table({(step, -1), (step, 0), (step, 1)})
+    for square, (row, _) in enumerate(INDEX_TO_POS):
+        if row == starting_row:
+            table[square] |= 1 << (square + 16 * step)
+    return table
+
+# Ciljna polja figur na prazni šahovnici za vsako izhodiščno polje. Kmetu štejemo
+# premik naprej, dvojni premik z začetne vrste in obe jemanji, roširanja pa ne.
+ROOK_TARGETS   = [sum(RAYS[d][0][sq] for d in ROOK_DIRECTIONS) for sq in range(64)]
+BISHOP_TARGETS = [sum(RAYS[d][0][sq] for d in BISHOP_DIRECTIONS) for sq in range(64)]
+QUEEN_TARGETS  = [ROOK_TARGETS[sq] | BISHOP_TARGETS[sq] for sq in range(64)]
+TARGETS = {
+    **{(Name.King, color): KING_ATTACKS for color in Color},
+    **{(Name.Queen, color): QUEEN_TARGETS for color in Color},
+    **{(Name.Rook, color): ROOK_TARGETS for color in Color},
+    **{(Name.Bishop, color): BISHOP_TARGETS for color in Color},
+    **{(Name.Knight, color): KNIGHT_ATTACKS for color in Color},
+    (Name.Pawn, Color.White): _pawn_targets(1, 2),
+    (Name.Pawn, Color.Black): _pawn_targets(-1, 7)
+}
+
+def _between_table():
+    between = [[0] * 64 for _ in range(64)]
+    for direction in DIRECTIONS:
+        rays, _ = RAYS[direction]
+        for start in range(64):
+            for end in bit_indices(rays[start]):
+                between[start][end] = rays[start] & ~rays[end] & ~(1 << end)
+    return between
+
+# Zobrist ključi: vsaki kombinaciji figure in polja ter pravicam do roširanja, stolpcu za
+# en passant in igralcu na potezi pripišemo naključno 64-bitno število. Ključ pozicije je XOR
+# ustreznih števil, zato ga ob premiku figure posodobimo z dvema operacijama XOR. Seme je fiksno,
+# da so ključi enaki v vseh procesih.
+_zobrist_random = random.Random(0x5EED)
+ZOBRIST_PIECES = {
+    (name, color): [_zobrist_random.getrandbits(64) for _ in range(64)]
+    for name in Name for color in Color
+}
+CASTLING_BITS = {'K': 1, 'Q': 2, 'k': 4, 'q': 8}
+_zobrist_castling = {right: _zobrist_random.getrandbits(64) for right in 'KQkq'}
+ZOBRIST_CASTLING = [0] * 16   # po vseh kombinacijah bitov pravic do roširanja
+for _bits in range(16):
+    for _right, _bit in CASTLING_BITS.items():
+        if _bits & _bit:
+            ZOBRIST_CASTLING[_bits] ^= _zobrist_castling[_right]
+ZOBRIST_EN_PASSANT = [0] + [_zobrist_random.getrandbits(64) for _ in range(8)]   # po stolpcih 1-8
+ZOBRIST_BLACK_TO_MOVE = _zobrist_random.getrandbits(64)
+
+def bit_indices(bitboard):
+    '''
+        Eno po eno vrnemo indekse prižganih bitov, od najnižjega do najvišjega.
+    '''
+    while bitboard:
+        low = bitboard & -bitboard
+        yield low.bit_length() - 1
+        bitboard ^= low
+
+# BETWEEN[a][b] so polja strogo med poljema na isti vrsti, stolpcu ali diagonali.
+# Za polji, ki nista poravnani, je vrednost 0.
+BETWEEN = _between_table()
+
+def sliding_attacks(square, occupied, directions):
+    '''
+        Polja, ki jih drseča figura na polju napada v danih smereh. Vsak žarek
+        odrežemo za prvo zasedenim poljem (to polje je še napadeno).
+    '''
+    attacks = 0
+    for direction in directions:
+        rays, increasing = RAYS[direction]
+        ray = rays[square]
+        blockers = ray & occupied
+        if blockers:
+            if increasing:
+                blocker = (blockers & -blockers).bit_length() - 1
+            else:
+                blocker = blockers.bit_length() - 1
+            ray ^= rays[blocker]
+        attacks |= ray
+    return attacks
+
+def rook_attacks(square, occupied):
+    return sliding_attacks(square, occupied, ROOK_DIRECTIONS)
+
+def bishop_attacks(square, occupied):
+    return sliding_attacks(square, occupied, BISHOP_DIRECTIONS)
+
+def queen_attacks(square, occupied):
+    return sliding_attacks(square, occupied, DIRECTIONS)
+
 TO_FEN = {
     (Name.King, Color.White)   : 'K',
     (Name.Queen, Color.White)  : 'Q',
@@ -95,6 +243,7 @@ TO_FEN = {
     (Name.Knight, Color.Black) : 'n',
     (Name.Pawn, Color.Black)   : 'p'
 }
+FROM_FEN = {char: piece for piece, char in TO_FEN.items()}
 
 TO_ANNOTATION = {
     '0': '',
@@ -169,6 +318,7 @@ FROM_FIGURINE_TO_ALGEBRAIC = {
     '\u265E': 'N',
     '\u265F': ''
 }
+FIGURINE_TO_ALGEBRAIC_TABLE = str.maketrans(FROM_FIGURINE_TO_ALGEBRAIC)
 
 PGN_COUNTRY_CODES = {
     'Afganistan': 'AFG',
@@ -401,31 +551,71 @@ def pos_to_square(position):
 def square_to_pos(square):
     return (int(square[-1]), 'abcdefgh'.index(square[0]) + 1)
 
-R_PIECE = r'(?P<name>[KQRBN]|[\u2654-\u2658\u265A-\u265E])(?P<file>[a-h])?(?P<rank>[1-8])?'\
-          r'(?P<captures>x)?(?P<target>[a-h][1-8])(?P<extra>[+#])?(?P<promo_piece>)(?P<castling>)(?P<long_castle>)'
-
-R_PAWN = r'(?P<name>[\u2659\u265F])?((?P<file>[a-h])(?P<captures>x))?(?P<target>[a-h][1-8])'\
-         r'(=(?P<promo_piece>[KQRBN]|[\u2654-\u265F]))?(?P<extra>[+#])?(?P<rank>)(?P<castling>)(?P<long_castle>)'
-
-R_CASTLING = r'(?P<castling>O-O(?P<long_castle>-O)?(?P<extra>[+#])?)(?P<name>)(?P<file>)'\
-             r'(?P<rank>)(?P<captures>)(?P<target>)(?P<promo_piece>)'
+def pos_to_index(position):
+    '''
+        Pozicijo (vrstica, stolpec) pretvorimo v indeks polja med 0 (a1) in 63 (h8).
+    '''
+    return 8 * (position[0] - 1) + position[1] - 1
+
+# Vse tri oblike notacije (figura, kmet, roširanje) v enem vnaprej prevedenem vzorcu;
+# figure lahko zapišemo s črko ali s figurinskim znakom.
+NOTATION_PATTERN = re.compile(
+    r'(?:(?P<castling>O-O(?P<long_castle>-O)?)'
+    r'|(?P<name>[KQRBN\u2654-\u2658\u265A-\u265E])(?P<file>[a-h])?(?P<rank>[1-8])?(?P<captures>x)?(?P<target>[a-h][1-8])'
+    r'|(?P<pawn>[\u2659\u265F])?(?:(?P<pawn_file>[a-h])x)?(?P<pawn_target>[a-h][1-8])'
+    r'(?:=(?P<promo_piece>[KQRBN\u2654-\u265F]))?)'
+    r'(?P<extra>[+#])?'
+)
+
+# Razčlenjena notacija: ime figure, barva (le pri figurinski notaciji, sicer None),
+# namiga za stolpec ('a'-'h') in vrstico (1-8), ciljno polje kot (vrstica, stolpec),
+# promocijska figura ter '+', '#' ali '' za šah oz. mat.
+ParsedNotation = namedtuple(
+    'ParsedNotation',
+    'name color file rank captures target promo_piece extra castling long_castle'
+)
+
+_NOTATION_SQUARES = {file + str(rank): (rank, col) for col, file in enumerate('abcdefgh', start=1) for rank in range(1, 9)}
 
 def parse_notation(notation):
     '''
-        Preverimo, ali prejeta notacija ustreza legalni potezi s pomočjo zgornjih
-        regex-ov in vrnemo ustrezni re.match objekt.
+        Notacijo razčlenimo z NOTATION_PATTERN in vrnemo ParsedNotation,
+        oziroma None, če notacija ni veljavna.
     '''
-    if (m := re.fullmatch(R_PIECE, notation)):
-        return m
-    elif (m := re.fullmatch(R_PAWN, notation)):
-        return m
-    elif (m := re.fullmatch(R_CASTLING, notation)):
-        return m
+    if (target := _NOTATION_SQUARES.get(notation)) is not None:   # najpogostejši primer, npr. e4
+        return ParsedNotation(Name.Pawn, None, None, None, False, target, None, '', False, False)
+
+    m = NOTATION_PATTERN.fullmatch(notation)
+    if m is None:
+        return None
+    castling, long_castle, name, file, rank, captures, target, pawn, pawn_file, pawn_target, promo_piece, extra = m.groups()
+
+    if castling:
+        return ParsedNotation(Name.King, None, None, None, False, None, None, extra or '', True, long_castle is not None)
+
+    if name:
+        name, color = FROM_NOTATION[name]
+        return ParsedNotation(name, color, file, rank and int(rank), captures is not None,
+                              _NOTATION_SQUARES[target], None, extra or '', False, False)
+
+    color = FROM_NOTATION[pawn][1] if pawn else None
+    promo_piece = FROM_NOTATION[promo_piece][0] if promo_piece else None
+    return ParsedNotation(Name.Pawn, color, pawn_file, None, pawn_file is not None,
+                          _NOTATION_SQUARES[pawn_target], promo_piece, extra or '', False, False)
 
 def to_figurine_notation(move, notation_info, *, anno='0'):
     '''
-        S sprejetima Move in NotationInfo objektoma [ter anotacijo z vrednostjo po PGN standardu],
-        korak po koraku sestavimo figurinsko notacijo.
+        S sprejetima Move in NotationInfo objektoma [ter anotacijo z vrednostjo po PGN standardu]
+        vrnemo figurinsko notacijo. Notacijo brez anotacije sestavimo le enkrat in jo shranimo
+        v NotationInfo, saj se zapis poteze po tem, ko je odigrana, ne spreminja več.
+    '''
+    if notation_info.san is None:
+        notation_info.san = _figurine_san(move, notation_info)
+    return notation_info.san + TO_ANNOTATION.get(anno, '')
+
+def _figurine_san(move, notation_info):
+    '''
+        Korak po koraku sestavimo figurinsko notacijo poteze.
     '''
     out = ''
     if move.castling:
@@ -439,7 +629,6 @@ def to_figurine_notation(move, notation_info, *, anno='0'):
         if notation_info.mate:
             out += '#'
 
-        out += TO_ANNOTATION.get(anno, '')
         return out
     elif move.piece == Name.Pawn:
         if notation_info.captures:
@@ -474,7 +663,6 @@ def to_figurine_notation(move, notation_info, *, anno='0'):
     if notation_info.mate:
         out += '#'
 
-    out += TO_ANNOTATION.get(anno, '')
     return out
 
 def to_algebraic_notation(move, notation_info, *, anno='0'):
@@ -482,7 +670,4 @@ def to_algebraic_notation(move, notation_info, *, anno='0'):
         Za algebrajsko notacijo samo pretvorimo figure, prisotne v figurinski notaciji,
         v velike črke.
     '''
-    algebraic = ''
-    for char in to_figurine_notation(move, notation_info, anno=anno):
-        algebraic += FROM_FIGURINE_TO_ALGEBRAIC.get(char, char)
-    return algebraic
+    return to_figurine_notation(move, notation_info, anno=anno).translate(FIGURINE_TO_ALGEBRAIC_TABLE)
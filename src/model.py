@@ -4,7 +4,6 @@ class Game:
     def __init__(self):
         self.in_play = set()
         self.captured = set()
-        self.promoted_pawns = []
 
         self.moves = []
 
@@ -23,38 +22,189 @@ class Game:
         self.half_move_number = 0
         self.full_move_number = 1
 
-        self.white_long_rook = Figure(Name.Rook, Color.White, (1, 1), ROOK_MOVES)
-        self.white_short_rook = Figure(Name.Rook, Color.White, (1, 8), ROOK_MOVES)
+        self.mailbox = [None] * 64
+        self.figures = {(name, color): [] for name in Name for color in Color}
+        self.bitboards = {(name, color): 0 for name in Name for color in Color}
+        self.occupied = {Color.White: 0, Color.Black: 0}
+        self.board_hash = 0
 
-        self.in_play.add(self.white_long_rook)
-        self.in_play.add(self.white_short_rook)
+        self.white_long_rook = Figure(Name.Rook, Color.White, (1, 1))
+        self.white_short_rook = Figure(Name.Rook, Color.White, (1, 8))
 
-        self.black_long_rook = Figure(Name.Rook, Color.Black, (8, 1), ROOK_MOVES)
-        self.black_short_rook = Figure(Name.Rook, Color.Black, (8, 8), ROOK_MOVES)
+        self.add_to_play(self.white_long_rook)
+        self.add_to_play(self.white_short_rook)
 
-        self.in_play.add(self.black_long_rook)
-        self.in_play.add(self.black_short_rook)
+        self.black_long_rook = Figure(Name.Rook, Color.Black, (8, 1))
+        self.black_short_rook = Figure(Name.Rook, Color.Black, (8, 8))
 
-        self.in_play.add(Figure(Name.King  , Color.White, (1, 5), KING_MOVES))
-        self.in_play.add(Figure(Name.Queen , Color.White, (1, 4), QUEEN_MOVES))
-        self.in_play.add(Figure(Name.Bishop, Color.White, (1, 3), BISHOP_MOVES))
-        self.in_play.add(Figure(Name.Bishop, Color.White, (1, 6), BISHOP_MOVES))
-        self.in_play.add(Figure(Name.Knight, Color.White, (1, 2), KNIGHT_MOVES))
-        self.in_play.add(Figure(Name.Knight, Color.White, (1, 7), KNIGHT_MOVES))
+        self.add_to_play(self.black_long_rook)
+        self.add_to_play(self.black_short_rook)
+
+        self.add_to_play(Figure(Name.King  , Color.White, (1, 5)))
+        self.add_to_play(Figure(Name.Queen , Color.White, (1, 4)))
+        self.add_to_play(Figure(Name.Bishop, Color.White, (1, 3)))
+        self.add_to_play(Figure(Name.Bishop, Color.White, (1, 6)))
+        self.add_to_play(Figure(Name.Knight, Color.White, (1, 2)))
+        self.add_to_play(Figure(Name.Knight, Color.White, (1, 7)))
         for i in range(1, 9):
-            self.in_play.add(Figure(Name.Pawn, Color.White, (2, i), WHITE_PAWN_MOVES))
-
-        self.in_play.add(Figure(Name.King  , Color.Black, (8, 5), KING_MOVES))
-        self.in_play.add(Figure(Name.Queen , Color.Black, (8, 4), QUEEN_MOVES))
-        self.in_play.add(Figure(Name.Bishop, Color.Black, (8, 3), BISHOP_MOVES))
-        self.in_play.add(Figure(Name.Bishop, Color.Black, (8, 6), BISHOP_MOVES))
-        self.in_play.add(Figure(Name.Knight, Color.Black, (8, 2), KNIGHT_MOVES))
-        self.in_play.add(Figure(Name.Knight, Color.Black, (8, 7), KNIGHT_MOVES))
+            self.add_to_play(Figure(Name.Pawn, Color.White, (2, i)))
+
+        self.add_to_play(Figure(Name.King  , Color.Black, (8, 5)))
+        self.add_to_play(Figure(Name.Queen , Color.Black, (8, 4)))
+        self.add_to_play(Figure(Name.Bishop, Color.Black, (8, 3)))
+        self.add_to_play(Figure(Name.Bishop, Color.Black, (8, 6)))
+        self.add_to_play(Figure(Name.Knight, Color.Black, (8, 2)))
+        self.add_to_play(Figure(Name.Knight, Color.Black, (8, 7)))
         for i in range(1, 9):
-            self.in_play.add(Figure(Name.Pawn, Color.Black, (7, i), BLACK_PAWN_MOVES))
+            self.add_to_play(Figure(Name.Pawn, Color.Black, (7, i)))
+
+        self.reset_memo()
+
+    @classmethod
+    def from_fen(cls, fen):
+        '''
+            Igro postavimo v pozicijo, opisano s FEN [Forsyth-Edwards Notation]. Števca potez
+            lahko manjkata (EPD), takrat vzamemo 0 in 1. Trdnjave na začetnih poljih povežemo
+            z ustreznimi atributi igre, saj se pravice do roširanja spremljajo po identiteti.
+            Pravico do roširanja brez kralja in trdnjave na začetnih poljih zavržemo.
+        '''
+        fields = fen.split()
+        if len(fields) == 4:
+            fields += ['0', '1']
+        if len(fields) != 6:
+            raise ValueError('Wrong FEN')
+        pieces, color, castling, en_passant, half_move, full_move = fields
+
+        rows = pieces.split('/')
+        if len(rows) != 8:
+            raise ValueError('Wrong FEN')
+        if color not in {'w', 'b'}:
+            raise ValueError('Wrong FEN')
+        if castling != '-' and (not castling or set(castling) - set('KQkq')):
+            raise ValueError('Wrong FEN')
+        if en_passant != '-':
+            if len(en_passant) != 2 or en_passant[0] not in 'abcdefgh':
+                raise ValueError('Wrong FEN')
+            if en_passant[1] != ('6' if color == 'w' else '3'):
+                raise ValueError('Wrong FEN')
+        if not half_move.isdigit() or not full_move.isdigit() or int(full_move) < 1:
+            raise ValueError('Wrong FEN')
+
+        game = cls()
+        for figure in list(game.in_play):
+            game.take_off_board(figure)
+
+        for i, row in enumerate(rows):
+            col = 1
+            for char in row:
+                if char in '12345678':
+                    col += int(char)
+                    continue
+                if char not in FROM_FEN or col > 8:
+                    raise ValueError('Wrong FEN')
+                name, fig_color = FROM_FEN[char]
+                if name == Name.Pawn and 8 - i in {1, 8}:
+                    raise ValueError('Wrong FEN')
+                game.add_to_play(Figure(name, fig_color, (8 - i, col)))
+                col += 1
+            if col != 9:
+                raise ValueError('Wrong FEN')
+
+        for fig_color in Color:
+            if len(game.figures[(Name.King, fig_color)]) != 1:
+                raise ValueError('Wrong FEN')
+
+        game.current_color = Color.White if color == 'w' else Color.Black
+        if game.is_king_in_check_now(other_color(game.current_color)):
+            raise ValueError('Wrong FEN')
+
+        def home_rook(position, fig_color, right):
+            rook = game.get_figure_by_pos(position)
+            king = game.get_figure_by_pos((position[0], 5))
+            if right not in castling or rook is None or king is None:
+                return None
+            if rook.name != Name.Rook or rook.color != fig_color:
+                return None
+            if king.name != Name.King or king.color != fig_color:
+                return None
+            return rook
+
+        game.white_long_rook = home_rook((1, 1), Color.White, 'Q')
+        game.white_short_rook = home_rook((1, 8), Color.White, 'K')
+        game.black_long_rook = home_rook((8, 1), Color.Black, 'q')
+        game.black_short_rook = home_rook((8, 8), Color.Black, 'k')
+
+        game.white_long_castle = game.white_long_rook is not None
+        game.white_short_castle = game.white_short_rook is not None
+        game.black_long_castle = game.black_long_rook is not None
+        game.black_short_castle = game.black_short_rook is not None
+
+        if en_passant != '-':
+            # polje za en passant mora biti prazno, tik za njim mora stati nasprotnikov kmet,
+            # polje, s katerega je kmet prišel, pa mora biti prazno
+            row, col = square_to_pos(en_passant)
+            step = -1 if game.current_color == Color.White else 1
+            pawn = game.get_figure_by_pos((row + step, col))
+            if (game.get_figure_by_pos((row, col)) is not None
+                    or game.get_figure_by_pos((row - step, col)) is not None
+                    or pawn is None or pawn.name != Name.Pawn or pawn.color == game.current_color):
+                raise ValueError('Wrong FEN')
+            game.en_passant_position = (row, col)
+        game.half_move_number = int(half_move)
+        game.full_move_number = int(full_move)
+
+        game.reset_memo()
+
+        if len(game.in_play) <= 4:
+            game.check_forced_draw()
+        if not game.has_legal_move(game.current_color):
+            if game.is_king_in_check_now(game.current_color):
+                game.game_state = GameState.Black if color == 'w' else GameState.White
+            else:
+                game.game_state = GameState.Draw
+        return game
+
+    def reset_memo(self):
+        '''
+            Trenutno pozicijo zapišemo kot začetno: pozabimo zapise za razveljavljanje
+            potez in ponovitve prejšnjih pozicij.
+        '''
+        self.undo_stack = []
+        self.repetitions = {self.position_hash: 1}
+
+    def castling_rights(self):
+        '''
+            Pravice do roširanja zapišemo kot bite (glej CASTLING_BITS).
+        '''
+        bits = 0
+        if self.white_short_castle:
+            bits |= CASTLING_BITS['K']
+        if self.white_long_castle:
+            bits |= CASTLING_BITS['Q']
+        if self.black_short_castle:
+            bits |= CASTLING_BITS['k']
+        if self.black_long_castle:
+            bits |= CASTLING_BITS['q']
+        return bits
+
+    def set_castling_rights(self, bits):
+        self.white_short_castle = bool(bits & CASTLING_BITS['K'])
+        self.white_long_castle = bool(bits & CASTLING_BITS['Q'])
+        self.black_short_castle = bool(bits & CASTLING_BITS['k'])
+        self.black_long_castle = bool(bits & CASTLING_BITS['q'])
 
-        self.save_states = [' '.join(self.generate_FEN().split()[:-2])]
-        self.half_move_memo = [0]
+    @property
+    def position_hash(self):
+        '''
+            Zobrist ključ pozicije. Del za figure (board_hash) sproti posodabljamo ob vsakem
+            premiku, ostale dele (igralec na potezi, roširanje, en passant) pa dodamo tu.
+        '''
+        key = self.board_hash ^ ZOBRIST_CASTLING[self.castling_rights()]
+        if self.current_color == Color.Black:
+            key ^= ZOBRIST_BLACK_TO_MOVE
+        if self.en_passant_position is not None:
+            key ^= ZOBRIST_EN_PASSANT[self.en_passant_position[1]]
+        return key
 
     @property
     def last_move(self):
@@ -66,10 +216,7 @@ class Game:
 
     def printable_state(self):   # uporabljeno le za tekstovni vmesnik
         out = ''
-        board = [['·'] * 8 for _ in range(8)]
-        for fig in self.in_play:
-            row, col = fig.position
-            board[row-1][col-1] = fig.as_piece()
+        board = [[fig.as_piece() if fig else '·' for fig in row] for row in self.board()]
         for i, row in enumerate(reversed(board)):
             out += ' '.join(row) + '  ' + str(8 - i) + '\n'
         out += 'a b c d e f g h'
@@ -79,99 +226,117 @@ class Game:
         '''
             Vrnemo gnezden seznam s figurami na svojihi mestih.
         '''
-        board = [[None] * 8 for _ in range(8)]
-        for fig in self.in_play:
-            row, col = fig.position
-            board[row-1][col-1] = fig
-        return board
+        return [self.mailbox[8 * row:8 * row + 8] for row in range(8)]
 
-    def generate_positions(self):
+    @property
+    def occupancy(self):
+        return self.occupied[Color.White] | self.occupied[Color.Black]
+
+    def add_to_play(self, figure):
         '''
-            Generiramo množici pozicij belih in črnih figur.
+            Figuro postavimo na šahovnico in jo vpišemo v vse pomožne strukture
+            (polje -> figura ter seznam figur po imenu in barvi).
         '''
-        pos_white = set()
-        pos_black = set()
-
-        for fig in self.in_play:
-            if fig.color == Color.White:
-                pos_white.add(fig.position)
-            else:
-                pos_black.add(fig.position)
-
-        return pos_white, pos_black
+        idx = pos_to_index(figure.position)
+        self.in_play.add(figure)
+        self.mailbox[idx] = figure
+        self.figures[(figure.name, figure.color)].append(figure)
+        self.bitboards[(figure.name, figure.color)] |= SQUARE_BB[idx]
+        self.occupied[figure.color] |= SQUARE_BB[idx]
+        self.board_hash ^= ZOBRIST_PIECES[(figure.name, figure.color)][idx]
+
+    def take_off_board(self, figure):
+        idx = pos_to_index(figure.position)
+        self.in_play.remove(figure)
+        if self.mailbox[idx] is figure:
+            self.mailbox[idx] = None
+        self.figures[(figure.name, figure.color)].remove(figure)
+        self.bitboards[(figure.name, figure.color)] &= ~SQUARE_BB[idx]
+        self.occupied[figure.color] &= ~SQUARE_BB[idx]
+        self.board_hash ^= ZOBRIST_PIECES[(figure.name, figure.color)][idx]
 
     def remove_from_play(self, figure):
-        self.in_play.remove(figure)
+        self.take_off_board(figure)
         self.captured.add(figure)
 
-    def get_figures_by_name(self, name, color):
-        out = []
-        for fig in self.in_play:
-            if fig.name == name and fig.color == color:
-                out.append(fig)
-        return out
+    def return_to_play(self, figure):
+        self.captured.discard(figure)
+        self.add_to_play(figure)
 
-    def get_figure_by_pos(self, pos):
-        for fig in self.in_play:
-            if fig.position == pos:
-                return fig
+    def set_position(self, figure, target):
+        '''
+            Premaknemo figuro na novo polje brez kakršnihkoli preverjanj.
+            Morebitno figuro na ciljnem polju moramo predhodno odstraniti.
+        '''
+        start = pos_to_index(figure.position)
+        end = pos_to_index(target)
+        if self.mailbox[start] is figure:
+            self.mailbox[start] = None
+        figure.position = target
+        self.mailbox[end] = figure
 
-    def promote_pawn(self, pawn, piece):
-        self.in_play.remove(pawn)
-        self.promoted_pawns.append(pawn)
-        self.in_play.add(Figure(piece, pawn.color, pawn.position, PROMOTION_MOVES[piece]))
+        key = (figure.name, figure.color)
+        self.bitboards[key] = self.bitboards[key] & ~SQUARE_BB[start] | SQUARE_BB[end]
+        self.occupied[figure.color] = self.occupied[figure.color] & ~SQUARE_BB[start] | SQUARE_BB[end]
+        self.board_hash ^= ZOBRIST_PIECES[key][start] ^ ZOBRIST_PIECES[key][end]
 
-    def undo_promotion(self, pawn):
-        promoted_piece = self.get_figure_by_pos(pawn.position)
-        self.in_play.remove(promoted_piece)
-        self.in_play.add(pawn)
+    def get_figures_by_name(self, name, color):
+        return list(self.figures[(name, color)])
 
-    def undo_last_move_promotion(self):
-        '''
-            Verzija self.undo_promotion(self, pawn), ki je uporabljena za
-            razveljavljenje zadnje poteze.
-        '''
-        pawn = self.promoted_pawns.pop()
-        self.in_play.add(pawn)
-        promoted_piece = self.get_figure_by_pos(self.last_move.target)
-        self.in_play.remove(promoted_piece)
+    def get_figure_by_pos(self, pos):
+        if pos[0] not in range(1, 9) or pos[1] not in range(1, 9):
+            return None
+        return self.mailbox[pos_to_index(pos)]
 
-    def update_game_state(self):
+    def update_castling_rights(self, figure, captured=None):
         '''
-            Po opravljeni potezi spremenimo trenutnega igralca, število opravljenih potez,
-            shranimo trenutno stanje [FEN standard] in preverimo prisiljene neodločene izide.
+            Po premiku kralja ali trdnjave izgubimo pravico do ustreznega roširanja.
+            Enako velja, če nasprotnik vzame trdnjavo, preden se je ta premaknila.
         '''
-        self.current_color = other_color(self.current_color)
+        if figure.name == Name.King:
+            if figure.color == Color.White:
+                self.white_short_castle = False
+                self.white_long_castle = False
+            else:
+                self.black_short_castle = False
+                self.black_long_castle = False
 
-        if self.last_move.color == Color.Black:
-            self.full_move_number += 1
-        if self.last_move.piece == Name.Pawn or self.last_notation_info.captures:
-            self.half_move_number = 0
-        else:
-            self.half_move_number += 1
+        for rook in (figure, captured):
+            if rook is None:
+                continue
+            if rook is self.white_short_rook:
+                self.white_short_castle = False
+            elif rook is self.white_long_rook:
+                self.white_long_castle = False
+            elif rook is self.black_short_rook:
+                self.black_short_castle = False
+            elif rook is self.black_long_rook:
+                self.black_long_castle = False
 
-        if len(self.in_play) <= 4:
+    def update_game_state(self, *, evaluate=True):
+        '''
+            Po opravljeni potezi preverimo konec igre in prisiljene neodločene izide.
+            Ponovitve pozicij štejemo po Zobrist ključih v slovarju.
+
+            Z evaluate=False preskočimo preverjanji, ki pregledata šahovnico (pat in premalo
+            figur za mat). To je smiselno le za vmesne poteze že odigrane igre, saj se igra
+            po njih ni mogla končati, ker je bila za njimi odigrana še kakšna poteza.
+        '''
+        if evaluate and len(self.in_play) <= 4:
             self.check_forced_draw()
         if self.last_notation_info.mate:
             if self.last_move.color == Color.White:
                 self.game_state = GameState.White
             else:
                 self.game_state = GameState.Black
-        elif not self.is_king_in_check_now(self.current_color):
-            for figure in self.in_play:
-                if figure.color == self.current_color:
-                    if len(list(self.figure_legal_moves(figure))) != 0:
-                        break
-            else:
-                self.game_state = GameState.Draw
+        elif evaluate and not self.has_legal_move(self.current_color):
+            self.game_state = GameState.Draw
 
-        current_fen = self.generate_FEN()
-        save_state = ' '.join(current_fen.split()[:-2])
-        self.save_states.append(save_state)
-        self.half_move_memo.append(self.half_move_number)
+        position_hash = self.position_hash
+        repetition = self.repetitions.get(position_hash, 0) + 1
+        self.repetitions[position_hash] = repetition
 
         if self.game_state == GameState.Normal:
-            repetition = self.save_states.count(save_state)
             if repetition == 5:
                 self.game_state = GameState.Draw
             elif repetition >= 3:
@@ -225,11 +390,9 @@ class Game:
         '''
             Generiramo FEN trenutnega stanje [Forsyth-Edwards Notation].
         '''
-        pieces = ''
-        board = [[None] * 8 for _ in range(8)]
-        for figure in self.in_play:
-            board[figure.position[0] - 1][figure.position[1] - 1] = figure
-        for row in reversed(board):
+        rows = []
+        for row in reversed(self.board()):
+            pieces = ''
             empty = 0
             for fig in row:
                 if fig is None:
@@ -241,7 +404,8 @@ class Game:
                     pieces += TO_FEN[(fig.name, fig.color)]
             if empty != 0:
                 pieces += str(empty)
-            pieces += '/'
+            rows.append(pieces)
+        pieces = '/'.join(rows)
 
         color = 'w' if self.current_color == Color.White else 'b'
 
@@ -274,18 +438,15 @@ class Game:
                  ki lahko pride na ciljno mesto
               -  če pride do promocije, katera figura naj nadomesti kmeta
         '''
-        notation_info = NotationInfo()
-        notation_info.promotion = promo_piece
+        notation_info = NotationInfo(promotion=promo_piece)
 
         opponent = other_color(figure.color)
         notation_info.check = self.is_king_in_check_after(figure, target, color=opponent, promo_piece=promo_piece)
         if notation_info.check:
             notation_info.mate = self.is_mate_after(figure, target, color=opponent, promo_piece=promo_piece)
 
-        same_pieces = self.get_figures_by_name(figure.name, figure.color)
-        same_pieces.remove(figure)
-        if len(same_pieces) != 0:
-            for fig in same_pieces:
+        for fig in self.notation_candidates(figure.name, figure.color, target):
+            if fig is not figure:
                 if self.is_legal(fig, target, promo_piece=promo_piece):
                     notation_info.unique = False
                     if fig.rank == figure.rank:
@@ -303,48 +464,104 @@ class Game:
         '''
             Generiramo Move objekt iz figure in ciljnega mesta [ter možne promocijske figure].
         '''
-        move = Move()
-        move.piece = figure.name
-        move.color = figure.color
-        move.start = figure.position
-        move.target = target
-        move.en_passant = self.is_en_passant(figure, target)
-        if castling_checked:
-            move.castling = True
+        en_passant = self.is_en_passant(figure, target)
+        if en_passant:
+            captured = self.get_figure_by_pos((figure.position[0], target[1]))
         else:
-            move.castling = self.is_castling_legal(figure, target)
-        move.promo_piece = promo_piece
-        move.captured = self.get_figure_by_pos(target)
-        return move
+            captured = self.get_figure_by_pos(target)
+        castling = castling_checked or self.is_castling_legal(figure, target)
+        return Move(figure.name, figure.color, figure.position, target, promo_piece, en_passant, castling, captured)
 
-    def move_figure_to(self, figure, target, *, promo_piece=None):
+    def apply_move(self, figure, target, *, promo_piece=None):
         '''
-            Premaknemo figuro na ciljno mesto in pri tem vzamemo nasprotnikovo figuro,
-            promoviramo, če je to potrebno, in nastavimo novo mesto za en passant.
+            Opravimo premik figure brez preverjanja legalnosti: vzamemo nasprotnikovo figuro,
+            premaknemo trdnjavo pri roširanju, promoviramo kmeta, posodobimo pravice do roširanja,
+            polje za en passant in števce ter predamo potezo. Na sklad shranimo zapis, s katerim
+            revert_move potezo razveljavi.
         '''
+        start = figure.position
+        promotion = figure.name == Name.Pawn and target[0] in {1, 8}
+        if promotion and promo_piece is None:
+            raise ValueError('Missing promotion piece')
+
         if self.is_en_passant(figure, target):
-            captured_figure = self.get_figure_by_pos(self.last_move.target)
+            captured = self.get_figure_by_pos((start[0], target[1]))
         else:
-            captured_figure = self.get_figure_by_pos(target)
+            captured = self.get_figure_by_pos(target)
 
-        if captured_figure:
-            self.remove_from_play(captured_figure)
+        castling = self.castling_rights()
+        en_passant = self.en_passant_position
+        half_move = self.half_move_number
+        position_hash = self.position_hash
 
-        if figure.name == Name.Pawn and target[0] in {4, 5} and figure.position[0] in {2, 7}:
-            if figure.position[0] == 2:
-                self.en_passant_position = (3, figure.position[1])
+        if captured is not None:
+            self.remove_from_play(captured)
+
+        if figure.name == Name.King and abs(target[1] - start[1]) == 2:
+            row = start[0]
+            if target[1] == 7:
+                self.set_position(self.get_figure_by_pos((row, 8)), (row, 6))
             else:
-                self.en_passant_position = (6, figure.position[1])
+                self.set_position(self.get_figure_by_pos((row, 1)), (row, 4))
+
+        if figure.name == Name.Pawn and abs(target[0] - start[0]) == 2:
+            self.en_passant_position = ((start[0] + target[0]) // 2, start[1])
         else:
             self.en_passant_position = None
 
-        figure.position = target
+        self.set_position(figure, target)
 
-        if figure.name == Name.Pawn and target[0] in {1, 8}:
-            if promo_piece is not None:
-                self.promote_pawn(figure, promo_piece)
-            else:
-                raise ValueError('Missing promotion piece')
+        promoted = None
+        if promotion:
+            promoted = Figure(promo_piece, figure.color, target)
+            self.take_off_board(figure)
+            self.add_to_play(promoted)
+
+        self.update_castling_rights(figure, captured)
+
+        if figure.name == Name.Pawn or captured is not None:
+            self.half_move_number = 0
+        else:
+            self.half_move_number += 1
+        if figure.color == Color.Black:
+            self.full_move_number += 1
+        self.current_color = other_color(figure.color)
+
+        self.undo_stack.append(UndoRecord(
+            figure, start, captured, promoted, castling, en_passant, half_move,
+            self.claimable_draw, position_hash
+        ))
+
+    def revert_move(self):
+        '''
+            Razveljavimo zadnji premik, opravljen z apply_move, in obnovimo stanje iz zapisa.
+        '''
+        record = self.undo_stack.pop()
+        figure = record.figure
+
+        if record.promoted is not None:
+            self.take_off_board(record.promoted)
+            figure.position = record.start
+            self.add_to_play(figure)
+        else:
+            if figure.name == Name.King and abs(figure.position[1] - record.start[1]) == 2:
+                row = record.start[0]
+                if figure.position[1] == 7:
+                    self.set_position(self.get_figure_by_pos((row, 6)), (row, 8))
+                else:
+                    self.set_position(self.get_figure_by_pos((row, 4)), (row, 1))
+            self.set_position(figure, record.start)
+
+        if record.captured is not None:
+            self.return_to_play(record.captured)
+
+        self.set_castling_rights(record.castling)
+        self.en_passant_position = record.en_passant
+        self.half_move_number = record.half_move
+        self.claimable_draw = record.claimable_draw
+        if figure.color == Color.Black:
+            self.full_move_number -= 1
+        self.current_color = figure.color
 
     def is_legal(self, figure, target, *, promo_piece=None):
         if self.is_move_possible(figure, target):
@@ -352,71 +569,96 @@ class Game:
                 return True
         return False
 
-    def is_move_possible(self, figure, target, *, ignore_king=False):
+    def attacks_from(self, name, color, square, occupied):
         '''
-            Preverimo, ali je premik figure možen oz. neoviran. Ne upoštevamo dejstva,
-            da bi lahko naš kralj po tem premiku bil v šahu.
+            Vrnemo bitno šahovnico polj, ki jih figura z danim imenom in barvo napada
+            z izbranega polja, pri čemer drseče figure ustavijo zasedena polja.
         '''
-        if not ignore_king:
-            opponent_king = self.get_figures_by_name(Name.King, other_color(figure.color))[0]
-            if target == opponent_king.position:
-                return False
-
-        move = (target[0] - figure.position[0], target[1] - figure.position[1])
-        number_of_moved_squares = max(abs(move[0]), abs(move[1]))
-        curr_position = figure.position
+        if name == Name.Knight:
+            return KNIGHT_ATTACKS[square]
+        if name == Name.King:
+            return KING_ATTACKS[square]
+        if name == Name.Pawn:
+            return PAWN_ATTACKS[color][square]
+        if name == Name.Rook:
+            return rook_attacks(square, occupied)
+        if name == Name.Bishop:
+            return bishop_attacks(square, occupied)
+        return queen_attacks(square, occupied)
+
+    def is_square_attacked(self, square, color, *, bitboards=None, occupied=None):
+        '''
+            Preverimo, ali katera figura barve color napada polje. Privzeto gledamo trenutno
+            stanje, lahko pa podamo tudi bitne šahovnice po namišljenem premiku.
+        '''
+        if bitboards is None:
+            bitboards = self.bitboards
+        if occupied is None:
+            occupied = self.occupancy
 
-        if target[0] not in range(1, 9) or target[1] not in range(1, 9):
-            return False
+        if PAWN_ATTACKS[other_color(color)][square] & bitboards[(Name.Pawn, color)]:
+            return True
+        if KNIGHT_ATTACKS[square] & bitboards[(Name.Knight, color)]:
+            return True
+        if KING_ATTACKS[square] & bitboards[(Name.King, color)]:
+            return True
+        queens = bitboards[(Name.Queen, color)]
+        sliders = ROOK_TARGETS[square] & (bitboards[(Name.Rook, color)] | queens)
+        sliders |= BISHOP_TARGETS[square] & (bitboards[(Name.Bishop, color)] | queens)
+        for slider in bit_indices(sliders):
+            if not BETWEEN[square][slider] & occupied:
+                return True
+        return False
 
-        if figure.name == Name.King and number_of_moved_squares == 2:
-            return self.is_castling_legal(figure, target)
+    def figure_targets(self, figure):
+        '''
+            Vrnemo bitno šahovnico vseh polj, na katera se figura lahko premakne, če ne
+            upoštevamo šaha lastnemu kralju. Roširanje obravnavamo posebej.
+        '''
+        color = figure.color
+        square = pos_to_index(figure.position)
+        own = self.occupied[color]
+        enemy = self.occupied[other_color(color)]
+        occupied = own | enemy
 
-        if move not in figure.possible_moves:
-            return False
+        if figure.name != Name.Pawn:
+            return self.attacks_from(figure.name, color, square, occupied) & ~own
 
-        if move[0] == 0:
-            dx = 0
-        else:
-            dx = move[0] // abs(move[0])
-        if move[1] == 0:
-            dy = 0
+        if color == Color.White:
+            step, starting_row = 8, 2
         else:
-            dy = move[1] // abs(move[1])
+            step, starting_row = -8, 7
 
-        pos_white, pos_black = self.generate_positions()
+        targets = 0
+        if not occupied & SQUARE_BB[square + step]:
+            targets |= SQUARE_BB[square + step]
+            if figure.rank == starting_row and not occupied & SQUARE_BB[square + 2 * step]:
+                targets |= SQUARE_BB[square + 2 * step]
 
-        if figure.color == Color.White and target in pos_white:
-            return False
-        if figure.color == Color.Black and target in pos_black:
-            return False
+        if self.en_passant_position is not None and color == self.current_color:
+            enemy |= SQUARE_BB[pos_to_index(self.en_passant_position)]
+        return targets | PAWN_ATTACKS[color][square] & enemy
 
-        if figure.name == Name.Knight:
-            return True
+    def is_move_possible(self, figure, target, *, ignore_king=False):
+        '''
+            Preverimo, ali je premik figure možen oz. neoviran. Ne upoštevamo dejstva,
+            da bi lahko naš kralj po tem premiku bil v šahu.
+        '''
+        if target[0] not in range(1, 9) or target[1] not in range(1, 9):
+            return False
 
-        if figure.name == Name.Pawn:
-            if number_of_moved_squares == 2:
-                if figure.color == Color.White and curr_position[0] != 2:
-                    return False
-                if figure.color == Color.Black and curr_position[0] != 7:
-                    return False
-            if move[1] != 0 and not self.is_en_passant(figure, target):
-                if figure.color == Color.White and target not in pos_black:
-                    return False
-                if figure.color == Color.Black and target not in pos_white:
-                    return False
-            else:
-                if target in pos_black or target in pos_white:
-                    return False
+        target_bb = SQUARE_BB[pos_to_index(target)]
+        if not ignore_king and target_bb & self.bitboards[(Name.King, other_color(figure.color))]:
+            return False
 
-        for i in range(1, number_of_moved_squares):
-            test_position = (curr_position[0] + i * dx, curr_position[1] + i * dy)
-            if test_position in pos_white or test_position in pos_black:
-                return False
+        if figure.name == Name.King and abs(target[1] - figure.position[1]) == 2:
+            return self.is_castling_legal(figure, target)
 
-        return True
+        if not TARGETS[(figure.name, figure.color)][pos_to_index(figure.position)] & target_bb:
+            return False
+        return bool(self.figure_targets(figure) & target_bb)
 
-    def is_castling_legal(self, king, target):   # tole ni najlepša koda na svetu, ampak deluje
+    def is_castling_legal(self, king, target):
         '''
             Preverimo, ali je možno roširanje. Potrebni pogoji so:
               -  roširanje poteka v robni vrsti
@@ -428,82 +670,39 @@ class Game:
         '''
         if king.name != Name.King:
             return False
-        if king.color == Color.White:
-            if target[1] == 7 and self.white_short_castle:
-                figure = self.get_figure_by_pos((1, 8))
-                if figure is None or figure.name != Name.Rook or figure.color == Color.Black:
-                    return False
-                if self.get_figure_by_pos((1, 6)) is not None or self.get_figure_by_pos((1, 7)) is not None:
-                    return False
-                if self.is_king_in_check_now(king.color):
-                    return False
-                king.position = (1, 6)
-                if self.is_king_in_check_now(king.color):
-                    king.position = (1, 5)
-                    return False
-                king.position = (1, 7)
-                if self.is_king_in_check_now(king.color):
-                    king.position = (1, 5)
-                    return False
-                king.position = (1, 5)
-
-            elif target[1] == 3 and self.white_long_castle:
-                figure = self.get_figure_by_pos((1, 1))
-                if figure is None or figure.name != Name.Rook or figure.color == Color.Black:
-                    return False
-                for col in range(2, 5):
-                    if self.get_figure_by_pos((1, col)) is not None:
-                        return False
-                if self.is_king_in_check_now(king.color):
-                    return False
-                king.position = (1, 4)
-                if self.is_king_in_check_now(king.color):
-                    king.position = (1, 5)
-                    return False
-                king.position = (1, 3)
-                if self.is_king_in_check_now(king.color):
-                    king.position = (1, 5)
-                    return False
-                king.position = (1, 5)
+
+        row = 1 if king.color == Color.White else 8
+        if king.position != (row, 5) or target[0] != row:
+            return False
+
+        if target[1] == 7:
+            if king.color == Color.White:
+                allowed = self.white_short_castle
             else:
-                return False
-        else:
-            if target[1] == 7 and self.black_short_castle:
-                figure = self.get_figure_by_pos((8, 8))
-                if figure is None or figure.name != Name.Rook or figure.color == Color.White:
-                    return False
-                if self.get_figure_by_pos((8, 6)) is not None or self.get_figure_by_pos((8, 7)) is not None:
-                    return False
-                if self.is_king_in_check_now(king.color):
-                    return False
-                king.position = (8, 6)
-                if self.is_king_in_check_now(king.color):
-                    king.position = (8, 5)
-                    return False
-                king.position = (8, 7)
-                if self.is_king_in_check_now(king.color):
-                    king.position = (8, 5)
-                    return False
-                king.position = (8, 5)
-            elif target[1] == 3 and self.black_long_castle:
-                figure = self.get_figure_by_pos((8, 1))
-                if figure is None or figure.name != Name.Rook or figure.color == Color.White:
-                    return False
-                for col in range(2, 5):
-                    if self.get_figure_by_pos((8, col)) is not None:
-                        return False
-                if self.is_king_in_check_now(king.color):
-                    return False
-                king.position = (8, 4)
-                if self.is_king_in_check_now(king.color):
-                    king.position = (8, 5)
-                    return False
-                king.position = (8, 3)
-                if self.is_king_in_check_now(king.color):
-                    king.position = (8, 5)
-                    return False
-                king.position = (8, 5)
+                allowed = self.black_short_castle
+            rook_col, passed = 8, (5, 6, 7)
+        elif target[1] == 3:
+            if king.color == Color.White:
+                allowed = self.white_long_castle
             else:
+                allowed = self.black_long_castle
+            rook_col, passed = 1, (5, 4, 3)
+        else:
+            return False
+
+        if not allowed:
+            return False
+
+        rook = self.get_figure_by_pos((row, rook_col))
+        if rook is None or rook.name != Name.Rook or rook.color != king.color:
+            return False
+
+        if BETWEEN[pos_to_index(king.position)][pos_to_index(rook.position)] & self.occupancy:
+            return False
+
+        opponent = other_color(king.color)
+        for col in passed:
+            if self.is_square_attacked(pos_to_index((row, col)), opponent):
                 return False
         return True
 
@@ -513,275 +712,273 @@ class Game:
         return self.en_passant_position == target
 
     def is_king_in_check_now(self, color):
-        king = self.get_figures_by_name(Name.King, color)[0]
-        for fig in list(self.in_play):
-            if fig.color == color:
-                continue
-            # ponavadi premik figure, kjer bi vzeli kralja, ni legalna, tu pa potrebujemo ravno to,
-            # zato nastavimo zastavico, ki preskoči ta pogoj v preverjanju poteze
-            if self.is_move_possible(fig, king.position, ignore_king=True):
-                return True
-        return False
+        king = self.bitboards[(Name.King, color)]
+        return self.is_square_attacked(king.bit_length() - 1, other_color(color))
 
-    def is_king_in_check_after(self, figure, target,  *, color=None, promo_piece=None):
+    def bitboards_after(self, figure, target, *, promo_piece=None):
         '''
-            Preverimo, ali je kralj [privzeto iste barve kot figura] v šahu po opravljenem premiku.
-            Po dobljenem odgovoru vrnemo stanje na začetno.
+            Izračunamo bitne šahovnice in zasedenost polj po premiku figure,
+            ne da bi pri tem spreminjali stanje igre.
         '''
-        if color is None:
-            color = figure.color
+        bitboards = dict(self.bitboards)
+        occupied = self.occupancy
+        start = SQUARE_BB[pos_to_index(figure.position)]
+        end = SQUARE_BB[pos_to_index(target)]
 
         if self.is_en_passant(figure, target):
-            removed_piece = self.get_figure_by_pos(self.last_move.target)
+            captured = self.get_figure_by_pos((figure.position[0], target[1]))
         else:
-            removed_piece = self.get_figure_by_pos(target)
-
-        if removed_piece:
-            self.remove_from_play(removed_piece)
-
-        starting_position = figure.position
-        en_passant = self.en_passant_position
-        castling = self.is_castling_legal(figure, target)
-
-        if castling:
-            if figure.color == Color.White:
-                row = 1
-            else:
-                row = 8
+            captured = self.get_figure_by_pos(target)
+
+        if captured is not None:
+            captured_bb = SQUARE_BB[pos_to_index(captured.position)]
+            bitboards[(captured.name, captured.color)] &= ~captured_bb
+            occupied &= ~captured_bb
+
+        name = figure.name
+        if name == Name.Pawn and target[0] in {1, 8} and promo_piece is not None:
+            name = promo_piece
+        bitboards[(figure.name, figure.color)] &= ~start
+        bitboards[(name, figure.color)] |= end
+        occupied = occupied & ~start | end
+
+        if figure.name == Name.King and abs(target[1] - figure.position[1]) == 2:
+            row = target[0]
             if target[1] == 7:
-                rook = self.get_figure_by_pos((row, 8))
-                rook_starting = rook.position
-                self.move_figure_to(rook, (row, 6))
-            elif target[1] == 3:
-                rook = self.get_figure_by_pos((row, 1))
-                rook_starting = rook.position
-                self.move_figure_to(rook, (row, 4))
-            self.move_figure_to(figure, target)
-        else:
-            self.move_figure_to(figure, target, promo_piece=promo_piece)
-
-        answer = self.is_king_in_check_now(color)
-
-        if promo_piece is not None:
-            self.undo_promotion(figure)
+                rook_move = SQUARE_BB[pos_to_index((row, 8))] | SQUARE_BB[pos_to_index((row, 6))]
+            else:
+                rook_move = SQUARE_BB[pos_to_index((row, 1))] | SQUARE_BB[pos_to_index((row, 4))]
+            bitboards[(Name.Rook, figure.color)] ^= rook_move
+            occupied ^= rook_move
 
-        if removed_piece:
-            self.in_play.add(removed_piece)
-            self.captured.remove(removed_piece)
+        return bitboards, occupied
 
-        figure.position = starting_position
-        self.en_passant_position = en_passant
+    def is_king_in_check_after(self, figure, target,  *, color=None, promo_piece=None):
+        '''
+            Preverimo, ali je kralj [privzeto iste barve kot figura] v šahu po opravljenem premiku.
+            Premik izvedemo le na kopiji bitnih šahovnic, zato stanja ni treba ponastavljati.
+        '''
+        if color is None:
+            color = figure.color
 
-        if castling:
-            rook.position = rook_starting
-        return answer
+        bitboards, occupied = self.bitboards_after(figure, target, promo_piece=promo_piece)
+        king = bitboards[(Name.King, color)]
+        return self.is_square_attacked(
+            king.bit_length() - 1,
+            other_color(color),
+            bitboards=bitboards,
+            occupied=occupied
+        )
 
-    def pawn_legal_moves(self, figure):
+    def check_and_pin_masks(self, color):
         '''
-            Izmed vseh možnih premikov kmeta, vrnemo vse legalne.
+            Za kralja barve color enkrat poiščemo figure, ki ga šahirajo, in vezane figure.
+            Vrnemo masko polj, na katere mora iti figura (razen kralja), da prekine šah,
+            ter slovar, ki vezani figuri (po indeksu polja) priredi žarek, po katerem se lahko
+            še premika - od kralja do vključno nasprotnikove figure, ki jo veže.
         '''
-        moves = []
-        pos_white, pos_black = self.generate_positions()
-
-        for dx, dy in figure.possible_moves:
-            target = (figure.position[0] + dx, figure.position[1] + dy)
-            if target[0] not in range(1, 9) or target[1] not in range(1, 9):
+        opponent = other_color(color)
+        bitboards = self.bitboards
+        king = bitboards[(Name.King, color)].bit_length() - 1
+        own = self.occupied[color]
+        occupied = own | self.occupied[opponent]
+        queens = bitboards[(Name.Queen, opponent)]
+        orthogonal = bitboards[(Name.Rook, opponent)] | queens
+        diagonal = bitboards[(Name.Bishop, opponent)] | queens
+
+        checkers = PAWN_ATTACKS[color][king] & bitboards[(Name.Pawn, opponent)]
+        checkers |= KNIGHT_ATTACKS[king] & bitboards[(Name.Knight, opponent)]
+        check_mask = checkers
+        pins = {}
+
+        for direction in DIRECTIONS:
+            rays, increasing = RAYS[direction]
+            ray = rays[king]
+            sliders = orthogonal if 0 in direction else diagonal
+            if not ray & sliders:
                 continue
-            if dx in {-2, 2}:
-                if figure.color == Color.White and figure.position[0] != 2:
-                    continue
-                if figure.color == Color.Black and figure.position[0] != 7:
-                    continue
-                blockade = (figure.position[0] + dx // 2, figure.position[1])
-                if blockade in pos_black or blockade in pos_white:
-                    continue
-                if target in pos_black or target in pos_white:
-                    continue
-            elif dy != 0 and not self.is_en_passant(figure, target):
-                if figure.color == Color.White and target not in pos_black:
-                    continue
-                if figure.color == Color.Black and target not in pos_white:
-                    continue
+            blockers = ray & occupied
+            if increasing:
+                first = (blockers & -blockers).bit_length() - 1
             else:
-                if target in pos_black or target in pos_white:
+                first = blockers.bit_length() - 1
+
+            if SQUARE_BB[first] & sliders:
+                checkers |= SQUARE_BB[first]
+                check_mask |= BETWEEN[king][first] | SQUARE_BB[first]
+            elif SQUARE_BB[first] & own:
+                blockers ^= SQUARE_BB[first]
+                if not blockers:
                     continue
-            if target[0] not in {1, 8}:
-                if not self.is_king_in_check_after(figure, target):
-                    move = self.get_move(figure, target)
-                    notation_info = self.get_notation_info(figure, target)
-                    moves.append((move, notation_info))
-            else:
-                for promo_piece in PROMOTION_PIECES:
-                    if not self.is_king_in_check_after(figure, target, promo_piece=promo_piece):
-                        move = self.get_move(figure, target, promo_piece=promo_piece)
-                        notation_info = self.get_notation_info(figure, target, promo_piece=promo_piece)
-                        moves.append((move, notation_info))
-        return moves
+                if increasing:
+                    second = (blockers & -blockers).bit_length() - 1
+                else:
+                    second = blockers.bit_length() - 1
+                if SQUARE_BB[second] & sliders:
+                    pins[first] = BETWEEN[king][second] | SQUARE_BB[second]
+
+        if checkers.bit_count() == 0:
+            check_mask = ALL_SQUARES
+        elif checkers.bit_count() > 1:
+            check_mask = 0
+        return check_mask, pins
 
-    def king_or_knight_legal_moves(self, figure):
+    def figure_legal_moves(self, figure, *, masks=None, notation=True):
         '''
-            Izmed vseh možnih premikov kralja oziroma skakača, vrnemo vse legalne.
+            Generiramo vse legalne poteze prejete figure. Možna ciljna polja dobimo iz bitnih
+            šahovnic in jih omejimo z maskama šaha in vezave (glej check_and_pin_masks), tako
+            da premik in preverjanje šaha opravimo le še za kralja in en passant.
+            Kmet na zadnji vrsti ustvari po eno potezo za vsako promocijsko figuro.
+
+            NotationInfo (šah, mat, dvoumnost) je drag, saj za mat generiramo vse nasprotnikove
+            poteze. Če ga klicatelj ne potrebuje (notation=False), namesto njega vrnemo None.
         '''
-        moves = []
-        pos_white, pos_black = self.generate_positions()
+        if masks is None:
+            masks = self.check_and_pin_masks(figure.color)
+        check_mask, pins = masks
 
-        for dx, dy in figure.possible_moves:
-            target = (figure.position[0] + dx, figure.position[1] + dy)
-            if target[0] not in range(1, 9) or target[1] not in range(1, 9):
-                continue
-            if figure.color == Color.White and target in pos_white:
-                continue
-            if figure.color == Color.Black and target in pos_black:
-                continue
-            if not self.is_king_in_check_after(figure, target):
-                move = self.get_move(figure, target)
-                notation_info = self.get_notation_info(figure, target)
+        opponent_king = self.bitboards[(Name.King, other_color(figure.color))]
+        targets = self.figure_targets(figure) & ~opponent_king
+        legal_targets = []
+
+        if figure.name == Name.King:
+            for square in bit_indices(targets):
+                target = INDEX_TO_POS[square]
+                if not self.is_king_in_check_after(figure, target):
+                    legal_targets.append(target)
+        else:
+            en_passant = 0
+            if figure.name == Name.Pawn and self.en_passant_position is not None:
+                en_passant = targets & SQUARE_BB[pos_to_index(self.en_passant_position)]
+
+            targets &= ~en_passant & check_mask & pins.get(pos_to_index(figure.position), ALL_SQUARES)
+            for square in bit_indices(targets):
+                legal_targets.append(INDEX_TO_POS[square])
+
+            if en_passant and not self.is_king_in_check_after(figure, self.en_passant_position):
+                legal_targets.append(self.en_passant_position)
+
+        moves = []
+        for target in legal_targets:
+            if figure.name == Name.Pawn and target[0] in {1, 8}:
+                promo_pieces = PROMOTION_PIECES
+            else:
+                promo_pieces = [None]
+            for promo_piece in promo_pieces:
+                move = self.get_move(figure, target, promo_piece=promo_piece)
+                if notation:
+                    notation_info = self.get_notation_info(figure, target, promo_piece=promo_piece)
+                else:
+                    notation_info = None
                 moves.append((move, notation_info))
+
         if figure.name == Name.King:
-            for dy in {-2, 2}:
+            for dy in (-2, 2):
                 target = (figure.position[0], figure.position[1] + dy)
                 if self.is_castling_legal(figure, target):
                     move = self.get_move(figure, target, castling_checked=True)
-                    notation_info = self.get_notation_info(figure, target)
+                    notation_info = self.get_notation_info(figure, target) if notation else None
                     moves.append((move, notation_info))
         return moves
 
-    def figure_legal_moves(self, figure):
-        '''
-            Generiramo vse legalne poteze prejete figure. Za kmeta, kralja in skakača uporabimo
-            pomožno funkcijo, za lovca, trdnjavo in kraljico pa iščemo vsa prazna mesta v primernih
-            smereh, dokler ne najdemo najdaljšega možnega premika v vsaki smeri.
-        '''
-        if figure.name == Name.Pawn:
-            return self.pawn_legal_moves(figure)
-
-        elif figure.name == Name.King or figure.name == Name.Knight:
-            return self.king_or_knight_legal_moves(figure)
-        else:
-            moves = []
-            pos_white, pos_black = self.generate_positions()
-            seen = [False] * 8
-            '''
-                     5 6 7
-            smeri := 3   4
-                     0 1 2
-            '''
-            if figure.name == Name.Rook:
-                for i in {0, 2, 5, 7}:
-                    seen[i] = True
-            elif figure.name == Name.Bishop:
-                for i in {1, 3, 4, 6}:
-                    seen[i] = True
-
-            for r in range(1, 8):
-                if all(seen):
-                    break
-                for idx, (dx, dy) in enumerate(DIRECTIONS):
-                    if seen[idx]:
-                        continue
-                    target = (figure.position[0] + r * dx, figure.position[1] + r * dy)
-                    if target[0] not in range(1, 9) or target[1] not in range(1, 9):
-                        seen[idx] = True
-                        continue
-                    if figure.color == Color.White:
-                        if target in pos_white:
-                            seen[idx] = True
-                            continue
-                        elif target in pos_black:
-                            seen[idx] = True
-                    else:
-                        if target in pos_black:
-                            seen[idx] = True
-                            continue
-                        elif target in pos_white:
-                            seen[idx] = True
-                    if not self.is_king_in_check_after(figure, target):
-                        move = self.get_move(figure, target)
-                        notation_info = self.get_notation_info(figure, target)
-                        moves.append((move, notation_info))
-            return moves
-
-    def all_legal_moves(self, color):
+    def all_legal_moves(self, color, *, notation=True):
         '''
             Eno po eno generiramo vse legalne poteze, ki jih lahko igralec opravi.
+            Šahe in vezave izračunamo le enkrat za vse figure. Z notation=False
+            preskočimo računanje NotationInfo (glej figure_legal_moves).
         '''
+        masks = self.check_and_pin_masks(color)
         for figure in list(self.in_play):
             if figure.color != color:
                 continue
-            yield from self.figure_legal_moves(figure)
+            yield from self.figure_legal_moves(figure, masks=masks, notation=notation)
+
+    def has_legal_move(self, color):
+        '''
+            Preverimo, ali ima igralec vsaj eno legalno potezo, ne da bi sestavljali Move
+            in NotationInfo objekte. Najprej poskusimo s kraljem, nato z jemanjem in šele
+            nato z ostalimi premiki, ter se ustavimo pri prvi najdeni potezi.
+        '''
+        check_mask, pins = self.check_and_pin_masks(color)
+        opponent = other_color(color)
+        opponent_king = self.bitboards[(Name.King, opponent)]
+        enemy = self.occupied[opponent] & ~opponent_king
+
+        king = self.figures[(Name.King, color)][0]
+        king_targets = KING_ATTACKS[pos_to_index(king.position)] & ~self.occupied[color] & ~opponent_king
+        for square in bit_indices(king_targets):
+            if not self.is_king_in_check_after(king, INDEX_TO_POS[square]):
+                return True
+
+        if not check_mask:   # dvojni šah
+            return False
+
+        en_passant = 0
+        if self.en_passant_position is not None and color == self.current_color:
+            en_passant = SQUARE_BB[pos_to_index(self.en_passant_position)]
+
+        figures = [
+            figure
+            for name in (Name.Queen, Name.Rook, Name.Bishop, Name.Knight, Name.Pawn)
+            for figure in self.figures[(name, color)]
+        ]
+        for wanted in (enemy, ~enemy):
+            for figure in figures:
+                allowed = check_mask & pins.get(pos_to_index(figure.position), ALL_SQUARES)
+                if self.figure_targets(figure) & wanted & allowed & ~en_passant & ~opponent_king:
+                    return True
+
+        for pawn in self.figures[(Name.Pawn, color)]:
+            if self.figure_targets(pawn) & en_passant:
+                if not self.is_king_in_check_after(pawn, self.en_passant_position):
+                    return True
+        return False
 
     def is_mate_after(self, figure, target, *, color=None, promo_piece=None):
         '''
             Preverimo, ali ima igralec [privzeto nasprotnik od barve figure] kakšno legalno potezo
-            po premiku. Nato ponastavimo stanje na začetno.
+            po premiku. Nato premik razveljavimo.
         '''
         if color is None:
             color = other_color(figure.color)
 
-        if self.is_en_passant(figure, target):
-            removed_piece = self.get_figure_by_pos(self.last_move.target)
-        else:
-            removed_piece = self.get_figure_by_pos(target)
-
-        if removed_piece:
-            self.remove_from_play(removed_piece)
-        starting_position = figure.position
-        en_passant = self.en_passant_position
-
-        castling = self.is_castling_legal(figure, target)
-        if castling:
-            if figure.color == Color.White:
-                row = 1
-            else:
-                row = 8
-            if target[1] == 7:
-                rook = self.get_figure_by_pos((row, 8))
-                rook_starting = rook.position
-                self.move_figure_to(rook, (row, 6))
-            elif target[1] == 3:
-                rook = self.get_figure_by_pos((row, 1))
-                rook_starting = rook.position
-                self.move_figure_to(rook, (row, 4))
-            self.move_figure_to(figure, target)
-        else:
-            self.move_figure_to(figure, target, promo_piece=promo_piece)
-
-        for _ in self.all_legal_moves(color):
-            answer = False
-            break
-        else:
-            answer = True
-
-        if promo_piece is not None:
-            self.undo_promotion(figure)
+        self.apply_move(figure, target, promo_piece=promo_piece)
+        answer = not self.has_legal_move(color)
+        self.revert_move()
+        return answer
 
-        if removed_piece:
-            self.in_play.add(removed_piece)
-            self.captured.remove(removed_piece)
+    def notation_candidates(self, name, color, target):
+        '''
+            Figure dane barve z danim imenom, ki bi po tabelah napadov lahko prišle
+            na ciljno polje. Figure (razen kmeta) napadajo simetrično, zato jih poiščemo
+            z napadi s ciljnega polja. Kralja vrnemo vedno, ker lahko tudi rošira.
+        '''
+        if name == Name.King:
+            return self.figures[(name, color)]
 
-        figure.position = starting_position
-        self.en_passant_position = en_passant
+        target_bb = SQUARE_BB[pos_to_index(target)]
+        if name == Name.Pawn:
+            reach = TARGETS[(name, color)]
+            return [fig for fig in self.figures[(name, color)] if reach[pos_to_index(fig.position)] & target_bb]
 
-        if castling:
-            rook.position = rook_starting
-        return answer
+        sources = self.attacks_from(name, color, pos_to_index(target), self.occupancy)
+        return [self.mailbox[square] for square in bit_indices(sources & self.bitboards[(name, color)])]
 
     def make_move_from_notation(self, notation):
         '''
-            Prejeto notacijo razčlenimo in glede na dobljen match objekt preverimo,
+            Prejeto notacijo razčlenimo in glede na dobljen ParsedNotation preverimo,
             da res samo ena figura lahko opravi to potezo. Roširanje obravnavamo posebej.
-            Nakar opravimo premik in nastavimo zastavice o morebitnem premiku kralja/trdnjave,
-            ki nam pomagajo pri roširanju.
+            Nakar opravimo premik.
         '''
         if self.game_state != GameState.Normal:
             raise ValueError('Game is already over')
 
-        if (match := parse_notation(notation)) is None:
+        if (parsed := parse_notation(notation)) is None:
             raise ValueError('Wrong notation')
 
-        if match.group('castling'):
+        if parsed.castling:
             king = self.get_figures_by_name(Name.King, self.current_color)[0]
-            if match.group('long_castle'):
+            if parsed.long_castle:
                 if self.current_color == Color.White:
                     target = (1, 3)
                 else:
@@ -798,51 +995,35 @@ class Game:
             move = self.get_move(king, target)
             notation_info = self.get_notation_info(king, target)
 
-            king.position = target
+            self.apply_move(king, target)
             self.moves.append((move, notation_info))
-
-            if king.color == Color.White:
-                self.white_long_castle = False
-                self.white_short_castle = False
-                if target[1] == 3:
-                    self.white_long_rook.position = (1, 4)
-                else:
-                    self.white_short_rook.position = (1, 6)
-            else:
-                self.black_long_castle = False
-                self.black_short_castle = False
-                if target[1] == 3:
-                    self.black_long_rook.position = (8, 4)
-                else:
-                    self.black_short_rook.position = (8, 6)
-
-            self.en_passant_position = None
             self.update_game_state()
             return None
 
-        name, fig_color = FROM_NOTATION.get(match.group('name'), (Name.Pawn, self.current_color))
-        if fig_color and fig_color != self.current_color:
+        name = parsed.name
+        if parsed.color and parsed.color != self.current_color:
             raise ValueError('Bad input - piece color and current color are different')
 
-        figures = self.get_figures_by_name(name, self.current_color)
-        target = square_to_pos(match.group('target'))
-
-        rank = None
-        if (notation_rank := match.group('rank')):
-            rank = int(notation_rank)
-        file = match.group('file')
+        target = parsed.target
+        rank = parsed.rank
+        file = parsed.file
 
-        promo_piece, _ = FROM_NOTATION.get(match.group('promo_piece'), (None, None))
+        promo_piece = parsed.promo_piece
+        if promo_piece is not None and promo_piece not in PROMOTION_PIECES:
+            raise ValueError('Wrong notation')
+        if name == Name.Pawn and target[0] in {1, 8} and promo_piece is None:
+            raise ValueError('Missing promotion piece')
 
         possible_figures = []
-        for fig in figures:
-            if not self.is_legal(fig, target, promo_piece=promo_piece):
-                continue
+        for fig in self.notation_candidates(name, self.current_color, target):
             if rank and fig.rank != rank:
                 continue
             if file and fig.file != file:
                 continue
-            possible_figures.append(fig)
+            if not self.is_move_possible(fig, target):
+                continue
+            if not self.is_king_in_check_after(fig, target, promo_piece=promo_piece):
+                possible_figures.append(fig)
 
         if len(possible_figures) == 0:
             raise ValueError('Illegal move')
@@ -854,153 +1035,55 @@ class Game:
         move = self.get_move(figure, target, promo_piece=promo_piece)
         notation_info = self.get_notation_info(figure, target, promo_piece=promo_piece)
 
-        self.move_figure_to(figure, target, promo_piece=promo_piece)
+        self.apply_move(figure, target, promo_piece=promo_piece)
         self.moves.append((move, notation_info))
-
-        if figure.name == Name.King:
-            if figure.color == Color.White:
-                self.white_short_castle = False
-                self.white_long_castle = False
-            else:
-                self.black_short_castle = False
-                self.black_long_castle = False
-
-        if figure is self.white_short_rook:
-            self.white_short_castle = False
-
-        elif figure is self.white_long_rook:
-            self.white_long_castle = False
-
-        elif figure is self.black_short_rook:
-            self.black_short_castle = False
-
-        elif figure is self.black_long_rook:
-            self.black_long_castle = False
-
         self.update_game_state()
 
-    def make_move(self, move):
+    def make_move(self, move, notation_info=None, *, trusted=False, evaluate=True):
         '''
             Ker imamo že Move objekt, natanko vemo katera figura se mora premakniti.
-            Roširanje obravnavamo posebej. Opravimo premik in nastavimo zastavice
-            o morebitnem premiku kralja/trdnjave, ki nam pomagajo pri roširanju.
+            Preverimo legalnost in opravimo premik.
+
+            Poteze, ki so bile že preverjene (npr. ob prvem vnosu), lahko opravimo s
+            trusted=True: legalnosti ne preverjamo, NotationInfo pa vzamemo podanega,
+            zato ostane le še premik in posodobitev stanja igre. Pri ponovnem igranju
+            zaporedja potez podamo evaluate=False za vse razen zadnje (glej update_game_state).
         '''
         if self.game_state != GameState.Normal:
             raise ValueError('Game is already over')
 
-        if move.color != self.current_color:
-            raise ValueError('Bad input - piece color and current color are different')
-
         figure = self.get_figure_by_pos(move.start)
+        if not trusted:
+            if move.color != self.current_color:
+                raise ValueError('Bad input - piece color and current color are different')
 
-        if not self.is_legal(figure, move.target, promo_piece=move.promo_piece):
-            raise ValueError('Illegal move')
-
-        notation_info = self.get_notation_info(figure, move.target, promo_piece=move.promo_piece)
-        self.moves.append((move, notation_info))
-
-        if move.castling:
-            if move.color == Color.White:
-                self.white_long_castle = False
-                self.white_short_castle = False
-                if move.target[1] == 3:
-                    self.white_long_rook.position = (1, 4)
-                else:
-                    self.white_short_rook.position = (1, 6)
-            else:
-                self.black_long_castle = False
-                self.black_short_castle = False
-                if move.target[1] == 3:
-                    self.black_long_rook.position = (8, 4)
-                else:
-                    self.black_short_rook.position = (8, 6)
-            figure.position = move.target
-            self.en_passant_position = None
-        else:
-            self.move_figure_to(figure, move.target, promo_piece=move.promo_piece)
-
-        if figure.name == Name.King:
-            if figure.color == Color.White:
-                self.white_short_castle = False
-                self.white_long_castle = False
-            else:
-                self.black_short_castle = False
-                self.black_long_castle = False
-
-        if figure is self.white_short_rook:
-            self.white_short_castle = False
-
-        elif figure is self.white_long_rook:
-            self.white_long_castle = False
-
-        elif figure is self.black_short_rook:
-            self.black_short_castle = False
+            if figure is None:
+                raise ValueError('Illegal move')
 
-        elif figure is self.black_long_rook:
-            self.black_long_castle = False
+            if not self.is_legal(figure, move.target, promo_piece=move.promo_piece):
+                raise ValueError('Illegal move')
 
-        self.update_game_state()
+        if notation_info is None or not trusted:
+            notation_info = self.get_notation_info(figure, move.target, promo_piece=move.promo_piece)
+        self.apply_move(figure, move.target, promo_piece=move.promo_piece)
+        self.moves.append((move, notation_info))
+        self.update_game_state(evaluate=evaluate)
 
     def undo_last_move(self):
         '''
-            Razveljavimo zadnjo potezo in vrnemo igro na zadnje shranjeno stanje.
+            Razveljavimo zadnjo potezo s pomočjo zapisa na skladu in odštejemo ponovitev
+            trenutne pozicije.
         '''
         if len(self.moves) == 0:
             raise ValueError('No moves to undo')
 
-        last_move, last_notation_info = self.moves.pop()
-
-        if self.game_state != GameState.Normal:
-            self.game_state = GameState.Normal
-
-        self.save_states.pop()
-        self.half_move_memo.pop()
-
-        if last_move.castling:
-            if last_move.color == Color.White:
-                if last_move.target[1] == 3:
-                    king = self.get_figure_by_pos((1, 3))
-                    king.position = (1, 5)
-                    self.white_long_rook.position = (1, 1)
-                else:
-                    king = self.get_figure_by_pos((1, 7))
-                    king.position = (1, 5)
-                    self.white_short_rook.position = (1, 8)
-            else:
-                if last_move.target[1] == 3:
-                    king = self.get_figure_by_pos((8, 3))
-                    king.position = (8, 5)
-                    self.black_long_rook.position = (8, 1)
-                else:
-                    king = self.get_figure_by_pos((8, 7))
-                    king.position = (8, 5)
-                    self.black_short_rook.position = (8, 8)
-        else:
-            if last_move.promo_piece:
-                self.undo_last_move_promotion()
-            figure = self.get_figure_by_pos(last_move.target)
-
-            figure.position = last_move.start
-            if last_move.captured:
-                self.in_play.add(last_move.captured)
-
-        last_save_state = self.save_states[-1].split()
-
-        castling_rights = last_save_state[2]
-        self.white_long_castle = 'Q' in castling_rights
-        self.white_short_castle = 'K' in castling_rights
-        self.black_long_castle = 'q' in castling_rights
-        self.black_short_castle = 'k' in castling_rights
+        self.moves.pop()
+        self.game_state = GameState.Normal
 
-        en_passant_square = last_save_state[3]
-        if en_passant_square == '-':
-            self.en_passant_position = None
+        position_hash = self.position_hash
+        if self.repetitions[position_hash] == 1:
+            del self.repetitions[position_hash]
         else:
-            self.en_passant_position = square_to_pos(en_passant_square)
-
-        self.half_move_number = self.half_move_memo[-1]
-
-        if last_move.color == Color.Black:
-            self.full_move_number -= 1
+            self.repetitions[position_hash] -= 1
 
-        self.current_color = last_move.color
\ No newline at end of file
+        self.revert_move()
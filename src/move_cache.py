@@ -0,0 +1,75 @@
+'''
+    Predpomnilnik legalnih potez, skupen vsem uporabnikom v procesu. Ključ je Zobrist ključ
+    pozicije (postavitev figur, igralec na potezi, pravice do roširanja in polje za
+    en passant), ki natanko določa legalne poteze, zato lahko isto pozicijo (npr. začetno
+    ali pogosto otvoritev) izračunamo le enkrat za vse uporabnike.
+
+    Hranimo le notacijo ter začetno in ciljno polje, ne pa Move objektov, saj ti preko
+    captured kažejo na figure igre, v kateri so bile poteze izračunane.
+'''
+import threading
+
+from collections import OrderedDict, namedtuple
+
+from src.definicije import *
+
+DEFAULT_MAXSIZE = 4096
+
+# Legalna poteza v predpomnilniku: algebrajska notacija ter začetno in ciljno polje (npr. 'e2').
+CachedMove = namedtuple('CachedMove', 'san start target')
+
+class LegalMoveCache:
+    '''
+        LRU predpomnilnik: ob zadetku pozicijo premaknemo na konec, ob polnem
+        predpomnilniku pa zavržemo najdlje neuporabljeno pozicijo.
+    '''
+    def __init__(self, maxsize=DEFAULT_MAXSIZE):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()   # ključ pozicije -> seznam CachedMove
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def legal_moves(self, game):
+        '''
+            Vrnemo seznam CachedMove za igralca na potezi v dani igri.
+        '''
+        key = game.position_hash
+        with self.lock:
+            moves = self.entries.get(key)
+            if moves is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return moves
+            self.misses += 1
+
+        moves = [
+            CachedMove(to_algebraic_notation(move, notation_info), pos_to_square(move.start), pos_to_square(move.target))
+            for move, notation_info in game.all_legal_moves(game.current_color)
+        ]
+
+        with self.lock:
+            self.entries[key] = moves
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+        return moves
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        return {
+            'size': len(self.entries),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions
+        }
@@ -0,0 +1,150 @@
+'''
+    Perft (performance test) za generator potez: preštejemo vse liste drevesa legalnih
+    potez do izbrane globine in čas, ki ga za to porabimo. Dobljena števila primerjamo
+    z znanimi vrednostmi za standardne testne pozicije, kar nam zagotavlja, da pohitritve
+    v src/model.py ne pokvarijo roširanja, en passant ali promocije.
+
+    Uporaba (iz projektne mape):
+        python -m src.perft                       # vse referenčne pozicije
+        python -m src.perft --max-nodes 100000    # ... tudi na večjih globinah
+        python -m src.perft "<FEN>" 3             # razdelitev po potezah za poljuben FEN
+'''
+import argparse
+import time
+
+from src.model import Game
+from src.definicije import *
+
+# (ime, FEN, znana števila listov za globine 1, 2, 3, ...)
+REFERENCE_POSITIONS = [
+    ('Začetna pozicija',
+     'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1',
+     [20, 400, 8902, 197281]),
+    ('Kiwipete',
+     'r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1',
+     [48, 2039, 97862]),
+    ('Pozicija 3 (en passant, vezave)',
+     '8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1',
+     [14, 191, 2812, 43238]),
+    ('Pozicija 4 (promocije, roširanje)',
+     'r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1',
+     [6, 264, 9467, 422333]),
+    ('Pozicija 5',
+     'rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8',
+     [44, 1486, 62379]),
+    ('Pozicija 6',
+     'r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10',
+     [46, 2079, 89890]),
+    ('Nedovoljen en passant (vezan kmet)',
+     '3k4/3p4/8/K1P4r/8/8/8/8 b - - 0 1',
+     [18, 92, 1670, 10138]),
+    ('En passant z odkritim šahom',
+     '8/8/1k6/2b5/2pP4/8/5K2/8 b - d3 0 1',
+     [15, 126, 1928, 13931]),
+    ('Kratko roširanje s šahom',
+     '5k2/8/8/8/8/8/8/4K2R w K - 0 1',
+     [15, 66, 1198, 6399]),
+    ('Dolgo roširanje s šahom',
+     '3k4/8/8/8/8/8/8/R3K3 w Q - 0 1',
+     [16, 71, 1286, 7418]),
+    ('Roširanje mimo napadenih polj',
+     'r3k2r/1b4bq/8/8/8/8/7B/R3K2R w KQkq - 0 1',
+     [26, 1141, 27826]),
+    ('Promocija iz šaha',
+     '2K2r2/4P3/8/8/8/8/8/3k4 w - - 0 1',
+     [11, 133, 1442, 19174]),
+    ('Promocija s šahom',
+     '4k3/1P6/8/8/8/8/K7/8 w - - 0 1',
+     [9, 40, 472, 2661]),
+    ('Podpromocija s šahom',
+     '8/P1k5/K7/8/8/8/8/8 w - - 0 1',
+     [6, 27, 273, 1329]),
+]
+
+def perft(game, depth):
+    '''
+        Preštejemo liste drevesa legalnih potez do dane globine. Na zadnji ravni
+        potez ne opravimo, ampak jih le preštejemo. NotationInfo ne potrebujemo.
+        Poteze opravimo z apply_move in razveljavimo z revert_move, zato ne računamo
+        stanja igre (mat, remi) kot make_move, kar perft tudi ne upošteva.
+    '''
+    moves = list(game.all_legal_moves(game.current_color, notation=False))
+    if depth <= 1:
+        return len(moves) if depth == 1 else 1
+
+    nodes = 0
+    for move, _ in moves:
+        game.apply_move(game.get_figure_by_pos(move.start), move.target, promo_piece=move.promo_piece)
+        nodes += perft(game, depth - 1)
+        game.revert_move()
+    return nodes
+
+def divide(game, depth):
+    '''
+        Za vsako potezo v korenu vrnemo njeno algebrajsko notacijo in število listov
+        pod njo. Uporabno pri iskanju napak, ko se skupno število ne ujema.
+    '''
+    out = []
+    for move, notation_info in list(game.all_legal_moves(game.current_color)):
+        game.apply_move(game.get_figure_by_pos(move.start), move.target, promo_piece=move.promo_piece)
+        out.append((to_algebraic_notation(move, notation_info), perft(game, depth - 1)))
+        game.revert_move()
+    return out
+
+def timed_perft(fen, depth):
+    '''
+        Vrnemo število listov in porabljen čas v sekundah.
+    '''
+    game = Game.from_fen(fen)
+    start = time.perf_counter()
+    nodes = perft(game, depth)
+    return nodes, time.perf_counter() - start
+
+def run_reference_suite(max_nodes=10000):
+    '''
+        Za vsako referenčno pozicijo preverimo vse globine, pri katerih število listov
+        ne presega max_nodes. Vrnemo True, če se vsa števila ujemajo.
+    '''
+    all_passed = True
+    total_nodes = 0
+    total_time = 0
+    for name, fen, expected_counts in REFERENCE_POSITIONS:
+        for depth, expected in enumerate(expected_counts, start=1):
+            if expected > max_nodes and depth > 1:
+                break
+            nodes, elapsed = timed_perft(fen, depth)
+            total_nodes += nodes
+            total_time += elapsed
+            status = 'OK' if nodes == expected else f'NAPAKA (pričakovano {expected})'
+            print(f'{name:40} globina {depth}: {nodes:>8} {_speed(nodes, elapsed)}  {status}')
+            all_passed = all_passed and nodes == expected
+    print(f'Skupaj: {total_nodes} listov {_speed(total_nodes, total_time)}')
+    return all_passed
+
+def _speed(nodes, elapsed):
+    return f'{elapsed:8.3f} s {nodes / elapsed if elapsed else 0:>10.0f} listov/s'
+
+def main():
+    parser = argparse.ArgumentParser(description='Perft za generator potez Chess-Annotator.')
+    parser.add_argument('fen', nargs='?', help='pozicija v FEN; brez nje preverimo referenčne pozicije')
+    parser.add_argument('depth', nargs='?', type=int, default=3, help='globina (privzeto 3)')
+    parser.add_argument('--max-nodes', type=int, default=10000,
+                        help='največje število listov pri preverjanju referenčnih pozicij')
+    args = parser.parse_args()
+
+    if args.fen is None:
+        raise SystemExit(0 if run_reference_suite(args.max_nodes) else 1)
+
+    game = Game.from_fen(args.fen)
+    start = time.perf_counter()
+    results = divide(game, args.depth)
+    elapsed = time.perf_counter() - start
+    for notation, nodes in sorted(results):
+        print(f'{notation}: {nodes}')
+    total = sum(nodes for _, nodes in results)
+    print()
+    print(f'Poteze: {len(results)}')
+    print(f'Listi: {total} {_speed(total, elapsed)}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,316 @@
+'''
+    Branje PGN datotek: iz datoteke (ali kateregakoli iterabilnega objekta z vrsticami)
+    po eno partijo naenkrat preberemo značke, poteze, NAG-e, komentarje, variante in
+    rezultat. V pomnilniku je vedno le trenutna partija, zato lahko beremo tudi zelo
+    velike zbirke partij.
+
+    Uporaba (iz projektne mape):
+        python -m src.pgn partije.pgn                          # pregled partij v datoteki
+        python -m src.pgn partije.pgn --replay                 # vzporedno preverjanje vseh potez
+        python -m src.pgn partije.pgn --replay --workers 4     # ... s štirimi procesi
+'''
+import argparse
+import os
+import re
+import time
+
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+from src.model import Game
+from src.definicije import *
+
+# Pripone za oceno poteze, zapisane neposredno za potezo, pretvorimo v ustrezne NAG-e.
+SUFFIX_NAGS = {'!': '1', '?': '2', '!!': '3', '??': '4', '!?': '5', '?!': '6'}
+
+RESULTS = {'1-0', '0-1', '1/2-1/2', '*'}
+SPECIAL_CHARS = re.compile(r'[{};()$!?%\[]')
+
+TAG_PATTERN = re.compile(r'\[\s*(?P<name>\w+)\s+"(?P<value>(?:[^"\\]|\\.)*)"\s*\]')
+TOKEN_PATTERN = re.compile(
+    r'\s+'
+    r'|(?P<comment>\{)'
+    r'|(?P<line_comment>;)'
+    r'|(?P<nag>\$\d+)'
+    r'|(?P<open>\()'
+    r'|(?P<close>\))'
+    r'|(?P<result>1-0|0-1|1/2-1/2|\*)'
+    r'|(?P<number>\d+\.*)'
+    r'|(?P<san>[^\s{}();$\[\]]+?)(?P<suffix>[!?]{1,2})?(?=[\s{}();$\[\]]|$)'
+    r'|(?P<other>.)'
+)
+
+class PgnMove:
+    __slots__ = ('notation', 'nags', 'comment', 'variations')
+
+    def __init__(self, notation):
+        self.notation = notation
+        self.nags = []
+        self.comment = ''
+        self.variations = []   # seznami potez, ki so alternativa tej potezi
+
+    @property
+    def anno(self):
+        '''
+            Prvi NAG, ki ga prepozna vmesnik (glej TO_ANNOTATION), sicer '0'.
+        '''
+        for nag in self.nags:
+            if nag in TO_ANNOTATION:
+                return nag
+        return '0'
+
+class PgnGame:
+    __slots__ = ('tags', 'moves', 'result', 'comment')
+
+    def __init__(self):
+        self.tags = {}
+        self.moves = []
+        self.result = '*'
+        self.comment = ''   # komentar pred prvo potezo
+
+    def is_empty(self):
+        return not self.tags and not self.moves
+
+def tokenize(lines):
+    '''
+        Iz vrstic eno po eno vrnemo žetone (vrsta, vrednost). Vrste so 'tag', 'comment',
+        'nag', 'open', 'close', 'result', 'san' in 'end_of_game' (nova skupina značk
+        za potezami, ki jih ni zaključil rezultat).
+    '''
+    comment = None
+    in_movetext = False
+    for line in lines:
+        if comment is not None:
+            end = line.find('}')
+            if end == -1:
+                comment.append(line)
+                continue
+            comment.append(line[:end])
+            yield 'comment', ' '.join(' '.join(comment).split())
+            comment = None
+            line = line[end + 1:]
+        elif line.startswith('%'):   # ubežna vrstica po PGN standardu
+            continue
+        elif line.lstrip().startswith('['):
+            if in_movetext:
+                in_movetext = False
+                yield 'end_of_game', None
+            for tag in TAG_PATTERN.finditer(line):
+                yield 'tag', (tag['name'], tag['value'].replace('\\"', '"').replace('\\\\', '\\'))
+            continue
+
+        if not SPECIAL_CHARS.search(line):   # najpogostejša vrstica: le številke potez in poteze
+            for word in line.split():
+                in_movetext = True
+                if word in RESULTS:
+                    yield 'result', word
+                elif (word := word.lstrip('0123456789.')):
+                    yield 'san', word
+            continue
+
+        pos = 0
+        while pos < len(line):
+            token = TOKEN_PATTERN.match(line, pos)
+            pos = token.end()
+            kind = token.lastgroup
+            if kind is None or kind in {'number', 'other'}:
+                continue
+            in_movetext = True
+            if kind == 'comment':
+                end = line.find('}', pos)
+                if end == -1:
+                    comment = [line[pos:]]
+                    break
+                yield 'comment', ' '.join(line[pos:end].split())
+                pos = end + 1
+            elif kind == 'line_comment':
+                yield 'comment', line[pos:].strip()
+                break
+            elif kind == 'nag':
+                yield 'nag', token['nag'][1:]
+            elif kind == 'san' or kind == 'suffix':
+                yield 'san', token['san']
+                if token['suffix']:
+                    yield 'nag', SUFFIX_NAGS.get(token['suffix'], '0')
+            else:
+                yield kind, token[kind]
+
+    if comment is not None:
+        yield 'comment', ' '.join(' '.join(comment).split())
+
+def read_games(lines):
+    '''
+        Iz vrstic (npr. odprte datoteke) eno po eno preberemo partije in vrnemo PgnGame
+        objekte. Partija se konča z rezultatom, z novo skupino značk ali s koncem datoteke.
+    '''
+    game = PgnGame()
+    line = game.moves      # trenutna (glavna ali stranska) varianta
+    stack = []
+
+    for kind, value in tokenize(lines):
+        if kind == 'tag':
+            game.tags[value[0]] = value[1]
+        elif kind == 'san':
+            line.append(PgnMove(value))
+        elif kind == 'nag':
+            if line:
+                line[-1].nags.append(value)
+        elif kind == 'comment':
+            if line:
+                line[-1].comment = f'{line[-1].comment} {value}'.strip()
+            elif not stack:
+                game.comment = f'{game.comment} {value}'.strip()
+        elif kind == 'open':
+            variation = []
+            if line:
+                line[-1].variations.append(variation)
+            stack.append(line)
+            line = variation
+        elif kind == 'close':
+            if stack:
+                line = stack.pop()
+        elif kind == 'result' and stack:
+            continue   # rezultat znotraj variante ne zaključi partije
+        else:   # 'result' ali 'end_of_game'
+            if kind == 'result':
+                game.result = value
+            if not game.is_empty():
+                yield game
+            game = PgnGame()
+            line = game.moves
+            stack = []
+
+    if not game.is_empty():
+        yield game
+
+def replay(pgn_game):
+    '''
+        Poteze glavne variante odigramo na novi šahovnici (oz. na poziciji iz značke FEN)
+        in vrnemo Game objekt. Nepravilna ali nelegalna poteza sproži ValueError.
+    '''
+    if 'FEN' in pgn_game.tags:
+        game = Game.from_fen(pgn_game.tags['FEN'])
+    else:
+        game = Game()
+    for move in pgn_game.moves:
+        game.make_move_from_notation(move.notation)
+    return game
+
+def write_tags(f, tags):
+    '''
+        Značke zapišemo po PGN standardu, vsako v svojo vrstico, in dodamo prazno vrstico.
+    '''
+    for name, value in tags.items():
+        value = value.replace('\\', '\\\\').replace('"', '\\"')
+        f.write(f'[{name} "{value}"]\n')
+    f.write('\n')
+
+def write_movetext(f, moves):
+    '''
+        Poteze v obliki (Move, NotationInfo, anotacija, tekst) zapišemo v algebrajski notaciji
+        s številkami potez, anotacijami kot NAG-i in tekstom kot komentarji.
+    '''
+    for idx, (move, notation_info, anno, text) in enumerate(moves):
+        alg_notation = to_algebraic_notation(move, notation_info)
+        if idx == 0:
+            f.write('1.')
+        elif move.color == Color.White:
+            f.write(f' {idx // 2 + 1}.')
+        f.write(f' {alg_notation}')
+        if anno != '0':
+            f.write(f'${anno}')
+        if text:
+            f.write(f' {{{text}}}')
+
+# Rezultat preverjanja ene partije: zaporedna številka partije v datoteki, FEN končne
+# pozicije, rezultat iz datoteke, napaka (None, če so vse poteze legalne) in polpoteza z napako.
+ReplayResult = namedtuple('ReplayResult', 'index fen result error ply')
+
+def replay_notations(index, notations, result='*', fen=None):
+    '''
+        Odigramo seznam notacij in vrnemo ReplayResult. Ob prvi napaki se ustavimo.
+    '''
+    try:
+        game = Game.from_fen(fen) if fen else Game()
+    except ValueError as err:
+        return ReplayResult(index, fen, result, err.args[0], 0)
+
+    for ply, notation in enumerate(notations, start=1):
+        try:
+            game.make_move_from_notation(notation)
+        except ValueError as err:
+            return ReplayResult(index, game.generate_FEN(), result, err.args[0], ply)
+    return ReplayResult(index, game.generate_FEN(), result, None, None)
+
+def _replay_batch(batch):
+    return [replay_notations(*item) for item in batch]
+
+def _batches(pgn_games, batch_size):
+    '''
+        Partije razdelimo v skupine, ki jih pošljemo procesom. Procesom pošljemo le
+        notacije, saj so PgnGame objekti z vsemi komentarji po nepotrebnem veliki.
+    '''
+    batch = []
+    for index, pgn_game in enumerate(pgn_games, start=1):
+        notations = [move.notation for move in pgn_game.moves]
+        batch.append((index, notations, pgn_game.result, pgn_game.tags.get('FEN')))
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def replay_games(pgn_games, *, workers=None, batch_size=50):
+    '''
+        Partije odigramo v skupini procesov in vrnemo ReplayResult objekte v enakem
+        vrstnem redu, kot so partije v datoteki. Hkrati čaka največ nekaj skupin na
+        proces, zato poraba pomnilnika ni odvisna od velikosti datoteke.
+    '''
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        for batch in _batches(pgn_games, batch_size):
+            yield from _replay_batch(batch)
+        return
+
+    with ProcessPoolExecutor(workers) as pool:
+        pending = deque()
+        for batch in _batches(pgn_games, batch_size):
+            pending.append(pool.submit(_replay_batch, batch))
+            if len(pending) >= 4 * workers:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+def main():
+    parser = argparse.ArgumentParser(description='Pregled partij v PGN datoteki.')
+    parser.add_argument('filename', help='pot do PGN datoteke')
+    parser.add_argument('--replay', action='store_true', help='odigramo vse poteze in preverimo legalnost')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='število procesov pri preverjanju (privzeto število jeder)')
+    args = parser.parse_args()
+
+    games = 0
+    errors = 0
+    start = time.perf_counter()
+    with open(args.filename, encoding='utf-8', errors='replace') as f:
+        if args.replay:
+            for result in replay_games(read_games(f), workers=args.workers):
+                games += 1
+                if result.error is None:
+                    print(f'{result.index:>6}. {result.result:8} {result.fen}')
+                else:
+                    errors += 1
+                    print(f'{result.index:>6}. NAPAKA v polpotezi {result.ply} ({result.error}): {result.fen}')
+        else:
+            for pgn_game in read_games(f):
+                games += 1
+                white = pgn_game.tags.get('White', '?')
+                black = pgn_game.tags.get('Black', '?')
+                print(f'{games:>6}. {white} - {black} {pgn_game.result} ({len(pgn_game.moves)} polpotez)')
+
+    elapsed = time.perf_counter() - start
+    print()
+    print(f'Partije: {games}, napake: {errors}, čas: {elapsed:.3f} s, {games / elapsed if elapsed else 0:.1f} partij/s')
+
+if __name__ == '__main__':
+    main()
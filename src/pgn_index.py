@@ -0,0 +1,333 @@
+'''
+    Indeks velikih PGN datotek: datoteko enkrat preberemo in si za vsako partijo zapomnimo
+    odmik v bajtih, dolžino in osnovne značke. Indeks shranimo poleg datoteke (z dodano
+    končnico .idx), zato lahko kasneje partijo N preberemo neposredno, brez branja vsega,
+    kar je pred njo.
+
+    Uporaba (iz projektne mape):
+        python -m src.pgn_index partije.pgn        # zgradimo indeks
+        python -m src.pgn_index partije.pgn 42     # izpišemo 42. partijo
+        python -m src.pgn_index partije.pgn --player Carlsen --result 1-0
+        python -m src.pgn_index --check            # preverimo meje partij na primerih
+        python -m src.pgn_index partije.pgn --check
+
+    Za iskanje po značkah datoteko preslikamo v pomnilnik (mmap) in preberemo le vrstice
+    z značkami, potez pa ne razčlenjujemo.
+'''
+import argparse
+import json
+import mmap
+import os
+import re
+import threading
+import time
+
+from collections import namedtuple
+
+from src.pgn import read_games, tokenize, PgnGame
+
+INDEX_VERSION = 3
+INDEX_SUFFIX = '.idx'
+
+# V indeks shranimo le značke obveznega nabora (Seven Tag Roster), da ostane majhen.
+INDEX_TAGS = {'Event', 'Site', 'Date', 'Round', 'White', 'Black', 'Result'}
+
+TAG_BYTES_PATTERN = re.compile(rb'\[\s*(\w+)\s+"((?:[^"\\]|\\.)*)"\s*\]')
+TAG_SECTION_PATTERN = re.compile(rb'(?:[ \t]*\[[^\n]*(?:\n|$)(?:[ \t\r]*\n)*)*')
+# Žetoni poteznega dela, ki vplivajo na meje partij (glej src.pgn.tokenize). Skupine
+# bi iskanje občutno upočasnile, zato vrsto žetona določimo po prvem bajtu.
+MOVETEXT_PATTERN = re.compile(rb'[{;()%\[*]|1-0|0-1|1/2-1/2')
+RESULT_BEFORE = {b'', b' ', b'\t', b'\r', b'\n', b')', b'}'}
+RESULT_AFTER = {b'', b' ', b'\t', b'\r', b'\n', b'{', b'}', b';', b'(', b')', b'['}
+CONTENT_PATTERN = re.compile(rb'\S')
+
+# Partija v indeksu: odmik in dolžina v bajtih ter slovar značk.
+IndexEntry = namedtuple('IndexEntry', 'offset length tags')
+
+# (ime, PGN) za preverjanje, ali scan_games najde iste partije kot read_games.
+BOUNDARY_SAMPLES = [
+    ('Partije brez značk', b'\n\n1. e4 e5 *\n\n1. d4 *\n'),
+    ('Partije brez značk v isti vrstici', b'1. e4 e5 1-0 1. d4 d5 0-1 1. c4 1/2-1/2'),
+    ('Značke v komentarju', b'[Event "A"]\n\n1. e4 {1-0\n[Event "B"]} e5 1-0\n[Event "C"]\n\n1. d4 *\n'),
+    ('Rezultat v varianti', b'1. e4 e5 (1... c5 2. Nf3 *) 2. Nf3 *\n1. d4 *'),
+    ('Rezultat v komentarju', b'1. e4 ; 1-0\n1... e5 *\n% 1-0\n1. Nf3 *'),
+    ('Komentar za rezultatom', b'[Event "A"]\n\n1. e4 * {konec}\n\n[Event "B"]\n\n1. d4 *\n'),
+    ('Komentar pred partijo', b'1. e4 * {uvod} 1. d4 *'),
+    ('Partija brez rezultata', b'[Event "A"]\n\n1. e4\n[Event "B"]\n\n1. d4 *\n'),
+]
+
+_loaded_indexes = {}   # pot -> (velikost, čas spremembe, seznam IndexEntry)
+_building = set()      # poti, katerih indeks ta trenutek gradi neka nit
+_building_lock = threading.Lock()
+
+def index_path(pgn_path):
+    return pgn_path + INDEX_SUFFIX
+
+def _movetext_end(data, pos):
+    '''
+        Odmik, pri katerem se konča potezni del, ki se začne na pos: za rezultatom zunaj
+        komentarjev in variant, na začetku vrstice z značko ali na koncu podatkov.
+    '''
+    size = len(data)
+    depth = 0
+    while (token := MOVETEXT_PATTERN.search(data, pos)) is not None:
+        start, pos = token.span()
+        char = token[0][:1]
+        if char == b'{':
+            end = data.find(b'}', pos)
+            if end == -1:
+                break
+            pos = end + 1
+        elif char == b';' or char == b'%' and data[start - 1:start] in {b'', b'\n'}:
+            end = data.find(b'\n', pos)
+            if end == -1:
+                break
+            pos = end   # konec vrstice pustimo, da najdemo morebitno značko v naslednji
+        elif char == b'(':
+            depth += 1
+        elif char == b')':
+            depth = max(depth - 1, 0)
+        elif char == b'[':
+            line_start = data.rfind(b'\n', 0, start) + 1
+            if not data[line_start:start].strip():
+                return line_start
+        elif char != b'%' and depth == 0:   # rezultat znotraj variante ne zaključi partije
+            if data[start - 1:start] in RESULT_BEFORE and data[pos:pos + 1] in RESULT_AFTER:
+                return pos
+    return size
+
+def _has_moves(data):
+    '''
+        Ali potezni del brez značk vsebuje kakšno potezo. Tako preskočimo npr. komentar
+        za rezultatom, ki ga read_games ne vrne kot partijo.
+    '''
+    text = bytes(data).decode('utf-8', 'replace')
+    return any(kind == 'san' for kind, _ in tokenize(text.splitlines(True)))
+
+def _decode_tag(value):
+    return value.decode('utf-8', 'replace').replace('\\"', '"').replace('\\\\', '\\')
+
+def scan_games(data, names=None):
+    '''
+        Iz bajtov (npr. mmap datoteke) eno po eno vrnemo IndexEntry za vsako partijo, pri
+        čemer preberemo le značke z imeni iz names (oz. vse, če je names None). Partija se
+        konča z rezultatom zunaj komentarjev in variant ali z vrstico z značkami, tako kot
+        pri read_games. Poteznega dela ne pretvorimo v niz, razen pri partijah brez značk.
+    '''
+    size = len(data)
+    first = CONTENT_PATTERN.search(data)
+    start = size if first is None else first.start()
+    while start < size:
+        tags = {}
+        section = TAG_SECTION_PATTERN.match(data, start)
+        found = TAG_BYTES_PATTERN.findall(section[0])
+        for name, value in found:
+            name = name.decode('ascii')
+            if names is None or name in names:
+                tags[name] = _decode_tag(value)
+
+        end = _movetext_end(data, section.end())
+        if found or _has_moves(data[start:end]):
+            yield IndexEntry(start, end - start, tags)
+
+        following = CONTENT_PATTERN.search(data, end)
+        start = size if following is None else following.start()
+
+def scan_headers(pgn_path, names=None):
+    '''
+        Značke vseh partij v datoteki preberemo prek mmap, brez razčlenjevanja potez.
+        Vrnemo seznam IndexEntry (odmik, dolžina, značke).
+    '''
+    with open(pgn_path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:   # prazne datoteke ne moremo preslikati
+            return []
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            return list(scan_games(data, names))
+
+def matches(tags, player=None, event=None, date=None, result=None):
+    '''
+        Ali značke ustrezajo vsem podanim pogojem. Igralca (belega ali črnega) in turnir
+        iščemo kot podniz ne glede na velike črke, datum kot začetek zapisa (npr. '2019.05'),
+        rezultat pa se mora ujemati natančno.
+    '''
+    if player and not any(player.lower() in tags.get(side, '').lower() for side in ('White', 'Black')):
+        return False
+    if event and event.lower() not in tags.get('Event', '').lower():
+        return False
+    if date and not tags.get('Date', '').startswith(date):
+        return False
+    if result and tags.get('Result') != result:
+        return False
+    return True
+
+def filter_games(entries, **conditions):
+    '''
+        Vrnemo pare (zaporedna številka, IndexEntry) za partije, ki ustrezajo pogojem
+        (glej matches). Številke partij se štejejo od 1.
+    '''
+    return [(number, entry) for number, entry in enumerate(entries, start=1)
+            if matches(entry.tags, **conditions)]
+
+def build_index(pgn_path):
+    '''
+        Zgradimo indeks datoteke in ga shranimo poleg nje. Najprej pišemo v začasno
+        datoteko, da hkratni bralec nikoli ne vidi napol zapisanega indeksa.
+    '''
+    stat = os.stat(pgn_path)
+    entries = scan_headers(pgn_path, INDEX_TAGS)
+
+    tmp_path = index_path(pgn_path) + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        header = {'version': INDEX_VERSION, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+        f.write(json.dumps(header) + '\n')
+        for entry in entries:
+            f.write(json.dumps([entry.offset, entry.length, entry.tags], ensure_ascii=False) + '\n')
+    os.replace(tmp_path, index_path(pgn_path))
+
+    _loaded_indexes[pgn_path] = (stat.st_size, stat.st_mtime_ns, entries)
+    return entries
+
+def load_index(pgn_path):
+    '''
+        Preberemo shranjeni indeks. Če ga ni ali pa se je datoteka od takrat spremenila,
+        vrnemo None.
+    '''
+    stat = os.stat(pgn_path)
+    cached = _loaded_indexes.get(pgn_path)
+    if cached is not None and cached[:2] == (stat.st_size, stat.st_mtime_ns):
+        return cached[2]
+
+    try:
+        with open(index_path(pgn_path), encoding='utf-8') as f:
+            header = json.loads(f.readline())
+            if header != {'version': INDEX_VERSION, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}:
+                return None
+            entries = [IndexEntry(*json.loads(line)) for line in f]
+    except (OSError, ValueError):
+        return None
+
+    _loaded_indexes[pgn_path] = (stat.st_size, stat.st_mtime_ns, entries)
+    return entries
+
+def get_index(pgn_path):
+    '''
+        Vrnemo indeks datoteke; če ga še ni ali je zastarel, ga zgradimo.
+    '''
+    entries = load_index(pgn_path)
+    if entries is None:
+        entries = build_index(pgn_path)
+    return entries
+
+def build_index_once(pgn_path):
+    '''
+        Zgradimo indeks, razen če ga ta trenutek že gradi druga nit (takrat vrnemo None).
+    '''
+    with _building_lock:
+        if pgn_path in _building:
+            return None
+        _building.add(pgn_path)
+    try:
+        return build_index(pgn_path)
+    finally:
+        with _building_lock:
+            _building.discard(pgn_path)
+
+def index_in_background(pgn_path):
+    '''
+        Vrnemo shranjeni indeks datoteke. Če ga še ni ali je zastarel, vrnemo None in ga
+        začnemo graditi v ločeni niti, da klicatelj (npr. strežnik) ne čaka.
+    '''
+    entries = load_index(pgn_path)
+    if entries is None:
+        threading.Thread(target=build_index_once, args=(pgn_path,), daemon=True).start()
+    return entries
+
+def read_game(pgn_path, entry):
+    '''
+        Preberemo in razčlenimo le partijo, ki jo opisuje IndexEntry.
+    '''
+    with open(pgn_path, 'rb') as f:
+        f.seek(entry.offset)
+        data = f.read(entry.length)
+    return next(read_games(data.decode('utf-8', 'replace').splitlines(True)), PgnGame())
+
+def check_boundaries(data):
+    '''
+        Ali scan_games v bajtih najde iste partije (značke in poteze) kot read_games.
+    '''
+    def summary(pgn_game):
+        return pgn_game.tags, [move.notation for move in pgn_game.moves], pgn_game.result
+
+    games = [summary(pgn_game) for pgn_game in read_games(bytes(data).decode('utf-8', 'replace').splitlines(True))]
+    entries = list(scan_games(data))
+    if len(entries) != len(games):
+        return False
+    for entry, game in zip(entries, games):
+        text = bytes(data[entry.offset:entry.offset + entry.length]).decode('utf-8', 'replace')
+        if [summary(pgn_game) for pgn_game in read_games(text.splitlines(True))] != [game]:
+            return False
+    return True
+
+def run_boundary_checks(pgn_path=None):
+    '''
+        Preverimo meje partij na primerih iz BOUNDARY_SAMPLES in v datoteki pgn_path, če
+        je podana. Vrnemo True, če se vse ujemajo.
+    '''
+    samples = list(BOUNDARY_SAMPLES)
+    if pgn_path is not None:
+        with open(pgn_path, 'rb') as f:
+            samples.append((pgn_path, f.read()))
+
+    all_passed = True
+    for name, data in samples:
+        passed = check_boundaries(data)
+        print(f'{name:40} {"OK" if passed else "NAPAKA"}')
+        all_passed = all_passed and passed
+    return all_passed
+
+def main():
+    parser = argparse.ArgumentParser(description='Indeks partij v PGN datoteki.')
+    parser.add_argument('filename', nargs='?', help='pot do PGN datoteke')
+    parser.add_argument('game', nargs='?', type=int, help='zaporedna številka partije, ki jo izpišemo')
+    parser.add_argument('--check', action='store_true',
+                        help='preverimo, ali indeks najde iste partije kot branje PGN (na primerih in v datoteki)')
+    parser.add_argument('--player', help='izpišemo partije igralca (del imena)')
+    parser.add_argument('--event', help='izpišemo partije s turnirja (del imena)')
+    parser.add_argument('--date', help='izpišemo partije z datumom, ki se začne tako (npr. 2019.05)')
+    parser.add_argument('--result', choices=['1-0', '0-1', '1/2-1/2', '*'], help='izpišemo partije s tem rezultatom')
+    args = parser.parse_args()
+
+    if args.check:
+        raise SystemExit(0 if run_boundary_checks(args.filename) else 1)
+    if args.filename is None:
+        parser.error('manjka pot do PGN datoteke')
+
+    conditions = {'player': args.player, 'event': args.event, 'date': args.date, 'result': args.result}
+    if any(conditions.values()):
+        start = time.perf_counter()
+        entries = scan_headers(args.filename)
+        found = filter_games(entries, **conditions)
+        elapsed = time.perf_counter() - start
+        for number, entry in found:
+            tags = entry.tags
+            print(f'{number:>6}. {tags.get("White", "?")} - {tags.get("Black", "?")} {tags.get("Result", "*")}'
+                  f' ({tags.get("Event", "?")}, {tags.get("Date", "?")})')
+        print()
+        print(f'Partije: {len(entries)}, najdene: {len(found)}, čas: {elapsed:.3f} s')
+        return
+
+    start = time.perf_counter()
+    entries = get_index(args.filename)
+    elapsed = time.perf_counter() - start
+    print(f'Partije: {len(entries)}, čas: {elapsed:.3f} s')
+
+    if args.game is not None:
+        if not 1 <= args.game <= len(entries):
+            raise SystemExit(f'Datoteka ima le {len(entries)} partij')
+        pgn_game = read_game(args.filename, entries[args.game - 1])
+        for name, value in pgn_game.tags.items():
+            print(f'[{name} "{value}"]')
+        print(' '.join(move.notation for move in pgn_game.moves), pgn_game.result)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+'''
+    Časovnica igre v vmesniku: za vsako polpotezo si zapomnimo Zobrist ključ pozicije, za
+    izbrane polpoteze pa še posnetek pozicije (FEN in stanje igre). Skok na poljubno
+    polpotezo je tako le obnova iz posnetka in kvečjemu nekaj odigranih potez, ne pa
+    ponovno odigravanje celotne igre.
+
+    Dokler je posnetkov manj kot SNAPSHOT_BUDGET, hranimo posnetek vsake polpoteze. Pri
+    daljših igrah obdržimo le posnetke na vsakih interval polpotez (kontrolne točke) in
+    interval po potrebi podvojimo, da poraba pomnilnika ostane omejena.
+'''
+from collections import Counter, namedtuple
+
+from src.model import Game
+
+SNAPSHOT_BUDGET = 256
+CHECKPOINT_INTERVAL = 8
+
+# Posnetek pozicije: FEN ter stanje igre in možnost remija, ki ju FEN ne vsebuje.
+PositionSnapshot = namedtuple('PositionSnapshot', 'fen game_state claimable_draw')
+
+class Timeline:
+    def __init__(self, game, *, budget=SNAPSHOT_BUDGET, interval=CHECKPOINT_INTERVAL):
+        self.budget = budget
+        self.interval = interval
+        self.hashes = []      # Zobrist ključ pozicije po vsaki polpotezi (0 je začetna pozicija)
+        self.snapshots = {}   # polpoteza -> PositionSnapshot
+        self.record(game)
+
+    def __len__(self):
+        '''
+            Število odigranih polpotez na časovnici.
+        '''
+        return len(self.hashes) - 1
+
+    def record(self, game):
+        '''
+            Zapišemo pozicijo po zadnji potezi igre. Pozicije, ki so sledile na časovnici
+            za to polpotezo, pozabimo.
+        '''
+        ply = len(game.moves)
+        self.truncate(ply - 1)
+        self.hashes.append(game.position_hash)
+        if ply % self.interval == 0 or len(self.hashes) <= self.budget:
+            self.snapshots[ply] = PositionSnapshot(game.generate_FEN(), game.game_state, game.claimable_draw)
+
+        while len(self.snapshots) > self.budget:
+            self.interval *= 2
+            self.snapshots = {p: snapshot for p, snapshot in self.snapshots.items() if p % self.interval == 0}
+
+    def truncate(self, ply):
+        '''
+            Pozabimo vse pozicije za dano polpotezo.
+        '''
+        del self.hashes[ply + 1:]
+        for p in [p for p in self.snapshots if p > ply]:
+            del self.snapshots[p]
+
+    def restore_snapshot(self, ply, moves):
+        '''
+            Iz posnetka obnovimo igro na dani polpotezi. Ponovitve pozicij preštejemo
+            iz zapisanih ključev, poteze pa vzamemo iz seznama (Move, NotationInfo, ...).
+        '''
+        snapshot = self.snapshots[ply]
+        game = Game.from_fen(snapshot.fen)
+        game.game_state = snapshot.game_state
+        game.claimable_draw = snapshot.claimable_draw
+        game.moves = [(move, notation_info) for move, notation_info, *_ in moves[:ply]]
+        game.repetitions = dict(Counter(self.hashes[:ply + 1]))
+        return game
+
+    def restore(self, ply, moves, current=None):
+        '''
+            Vrnemo igro na dani polpotezi. Izberemo najkrajšo pot: razveljavljanje potez
+            trenutne igre (current), igranje naprej od trenutne igre ali pa obnovo iz
+            najbližjega prejšnjega posnetka in igranje naprej od tam. Poteze so bile
+            preverjene, ko so bile prvič odigrane, zato jih opravimo brez preverjanja,
+            konec igre pa preverimo le po zadnji (glej Game.make_move).
+        '''
+        start = max(p for p in self.snapshots if p <= ply)
+        if current is not None:
+            current_ply = len(current.moves)
+            if current_ply >= ply and current_ply - ply <= len(current.undo_stack):
+                if current_ply - ply <= ply - start:
+                    for _ in range(current_ply - ply):
+                        current.undo_last_move()
+                    return current
+            elif current_ply < ply and ply - current_ply <= ply - start:
+                return self.replay(current, ply, moves)
+
+        return self.replay(self.restore_snapshot(start, moves), ply, moves)
+
+    @staticmethod
+    def replay(game, ply, moves):
+        for move, notation_info, *_ in moves[len(game.moves):ply]:
+            game.make_move(move, notation_info, trusted=True, evaluate=len(game.moves) == ply - 1)
+        return game